@@ -0,0 +1,258 @@
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from cache import TTLCache
+from metrics import metrics
+
+class AdmissionError(Exception):
+    """Raised when an upstream call is refused before it's made"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def describe(self):
+        """User-facing message"""
+        if self.retry_after:
+            return f"⏳ {self} Please try again in {max(1, round(self.retry_after))}s."
+        return f"⏳ {self} Please try again in a little while."
+
+class CooldownError(AdmissionError):
+    """The user asked again before their cooldown ran out"""
+
+class CircuitOpenError(AdmissionError):
+    """The upstream has been failing and is being given time to recover"""
+
+class OverloadedError(AdmissionError):
+    """Too many calls are already waiting for the upstream"""
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts with AIMD: each call that finishes under the target latency
+    raises the limit by about one per limit's worth of calls, while a slow or failed call cuts it
+    (by `backoff` or in half). Callers beyond the limit wait in line, up to max_waiting of them.
+    """
+
+    def __init__(self, min_limit, max_limit, target_latency, backoff=0.9, max_waiting=20):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.max_waiting = max_waiting
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self, timeout=None):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_waiting:
+            raise OverloadedError("is too busy right now.")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            raise OverloadedError("is too busy right now.") from None
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot while being cancelled; pass it on
+                self.in_flight -= 1
+                self._wake()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, latency=None, ok=True):
+        self.in_flight -= 1
+        if not ok:
+            self.limit = max(self.min_limit, self.limit / 2)
+        elif latency is not None and latency > self.target_latency:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif latency is not None:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and refuses calls for `reset_timeout` seconds,
+    then lets a single probe through (half-open): success closes it again, failure reopens it.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def check(self):
+        """Raise CircuitOpenError unless a call may go ahead now"""
+        state = self.state
+        if state == "open":
+            retry_after = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError("is having trouble right now.", retry_after=retry_after)
+        if state == "half-open" and self.probing:
+            raise CircuitOpenError("is recovering from errors.", retry_after=self.reset_timeout)
+
+    def start(self):
+        """Note that a call is going ahead; returns True if it's the half-open probe"""
+        if self.state == "half-open":
+            self.probing = True
+            return True
+        return False
+
+    def record(self, ok):
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+
+class Upstream:
+    """
+    Admission control for one upstream API: per-user cooldowns, a circuit breaker and an
+    adaptive concurrency limit. Call admit() before doing any work for a request, then wrap
+    the upstream call itself in slot().
+    """
+
+    def __init__(self, name, label, max_concurrency, target_latency, cooldown=0, min_concurrency=1,
+                 max_waiting=20, wait_timeout=30, failure_threshold=5, reset_timeout=30, is_failure=None):
+        self.name = name
+        self.label = label
+        self.limiter = AdaptiveLimiter(min_concurrency, max_concurrency, target_latency, max_waiting=max_waiting)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.cooldown = cooldown
+        self.cooldowns = TTLCache(maxsize=10000, ttl=cooldown) if cooldown else None
+        self.wait_timeout = wait_timeout
+        # Errors that say nothing about the upstream's health (bad input, etc.) can be excluded
+        self.is_failure = is_failure or (lambda error: True)
+        self.rejected = 0
+
+    def _reject(self, error, reason):
+        # Errors are raised with just the predicate; say which upstream they're about
+        error.args = (f"{self.label} {error.args[0]}",)
+        self.rejected += 1
+        metrics.inc("admission_rejected_total", upstream=self.name, reason=reason)
+        raise error
+
+    def admit(self, user_id, message_id=None):
+        """
+        Fail fast if the breaker is open or the user is on cooldown; otherwise start their cooldown.
+        The cooldown belongs to the message that started it, so re-running the same message
+        (after an edit) isn't refused by its own cooldown.
+        """
+        try:
+            self.breaker.check()
+        except CircuitOpenError as e:
+            self._reject(e, "circuit_open")
+        if self.cooldowns is not None:
+            cooldown = self.cooldowns.get(user_id)
+            if cooldown is not None and (message_id is None or cooldown[1] != message_id):
+                self._reject(CooldownError("is on cooldown for you.", retry_after=cooldown[0] - time.monotonic()), "cooldown")
+            self.cooldowns[user_id] = (time.monotonic() + self.cooldown, message_id)
+
+    def refund(self, user_id, message_id=None):
+        """Give back a cooldown started by admit() for a request that was refused later on (queue full, overloaded)"""
+        if self.cooldowns is not None:
+            cooldown = self.cooldowns.get(user_id)
+            if cooldown is not None and cooldown[1] == message_id:
+                del self.cooldowns[user_id]
+
+    @asynccontextmanager
+    async def slot(self, acquire=True):
+        """
+        Hold one of the upstream's concurrency slots for the duration of a call.
+        Callers whose own queue already runs at most limiter.limit calls (a JobScheduler driven
+        by it) pass acquire=False: the call is still timed and counted, but never waits a second time.
+        """
+        try:
+            self.breaker.check()
+        except CircuitOpenError as e:
+            self._reject(e, "circuit_open")
+        probe = self.breaker.start()
+        try:
+            if acquire:
+                try:
+                    await self.limiter.acquire(self.wait_timeout)
+                except OverloadedError as e:
+                    self._reject(e, "overloaded")
+            else:
+                self.limiter.in_flight += 1
+            start = time.perf_counter()
+            try:
+                yield
+            except asyncio.CancelledError:
+                # The caller gave up (e.g. the command was edited); that says nothing about the upstream
+                self.limiter.release()
+                raise
+            except Exception as e:
+                ok = not self.is_failure(e)
+                self.breaker.record(ok)
+                self.limiter.release(time.perf_counter() - start, ok=ok)
+                raise
+            self.breaker.record(True)
+            self.limiter.release(time.perf_counter() - start)
+        finally:
+            if probe:
+                self.breaker.probing = False
+            self._publish()
+
+    def _publish(self):
+        metrics.set("admission_limit", self.limiter.limit, upstream=self.name)
+        metrics.set("circuit_open", int(self.breaker.state != "closed"), upstream=self.name)
+
+    def describe(self):
+        """One-line summary for the info commands"""
+        limiter = self.limiter
+        text = (f"Limit: {limiter.limit:.1f} (of {limiter.max_limit}) | In flight: {limiter.in_flight} | "
+                f"Waiting: {limiter.waiting}\nBreaker: {self.breaker.state}")
+        if self.breaker.failures:
+            text += f" ({self.breaker.failures} recent failures)"
+        text += f" | Trips: {self.breaker.trips} | Rejected: {self.rejected}"
+        if self.cooldown:
+            text += f" | Cooldown: {self.cooldown}s"
+        return text
+
+class Admission:
+    """Registry of upstreams, kept outside the cogs so limits and breaker state survive a cog reload"""
+
+    def __init__(self):
+        self.upstreams = {}
+
+    def upstream(self, name, **settings):
+        """Return the named upstream, creating it with these settings the first time"""
+        upstream = self.upstreams.get(name)
+        if upstream is None:
+            upstream = self.upstreams[name] = Upstream(name, **settings)
+        return upstream
+
+# Shared registry for the whole bot
+admission = Admission()
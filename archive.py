@@ -0,0 +1,153 @@
+import os
+import gzip
+import glob
+import shutil
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+class ArchiveWriter:
+    """
+    Buffers lines in memory and appends them to a file in batches from a background task.
+    Callers never touch the disk: put() only appends to a bounded queue. The file is
+    rotated by size or date, and closed segments can be gzipped and pruned.
+    """
+
+    def __init__(self, path, max_queue=10000, batch_size=500, flush_interval=2.0,
+                 max_bytes=10 * 1024 * 1024, rotate_daily=True, backup_count=10, compress=True):
+        self.path = path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.backup_count = backup_count
+        self.compress = compress
+
+        self.queue = deque()
+        self.dropped = 0
+        self.written = 0
+        self._io_lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+
+    def put(self, line):
+        """Queue a line for writing. Returns False if the queue is full and the line was dropped."""
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            return False
+        self.queue.append(line)
+        if len(self.queue) >= self.batch_size and self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # Loop already closed
+        return True
+
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = self._loop.create_task(self._run())
+
+    async def close(self):
+        """Stop the background task and write whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._loop = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self.queue:
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as e:
+                    # Can't go through log_error here, it writes through an archive too
+                    print(f"Failed to flush archive {self.path}: {e}")
+
+    def _drain(self):
+        batch = []
+        while self.queue and len(batch) < self.batch_size:
+            batch.append(self.queue.popleft())
+        return batch
+
+    def flush(self):
+        """Write all queued lines to disk (blocking, runs in a worker thread)"""
+        with self._io_lock:
+            while self.queue:
+                batch = self._drain()
+                data = "".join(batch)
+                try:
+                    self._maybe_rotate(len(data.encode("utf-8")))
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    with open(self.path, "a", encoding="utf-8", newline="") as file:
+                        file.write(data)
+                except Exception:
+                    # Put the batch back so the next flush retries it instead of losing it
+                    self.queue.extendleft(reversed(batch))
+                    raise
+                self.written += len(batch)
+
+    def _maybe_rotate(self, incoming_bytes):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        too_big = self.max_bytes and stat.st_size + incoming_bytes > self.max_bytes
+        segment_date = datetime.fromtimestamp(stat.st_mtime).date()
+        new_day = self.rotate_daily and segment_date != datetime.now().date()
+        if stat.st_size and (too_big or new_day):
+            self._rotate()
+
+    def _rotate(self):
+        rotated = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        os.replace(self.path, rotated)
+        if self.compress:
+            with open(rotated, "rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        self._prune()
+
+    def segments(self):
+        """Closed segments for this archive, oldest first"""
+        return sorted(glob.glob(f"{glob.escape(self.path)}.*"))
+
+    def _prune(self):
+        segments = self.segments()
+        if self.backup_count is not None:
+            for old in segments[:max(0, len(segments) - self.backup_count)]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+class ArchiveHandler(logging.Handler):
+    """Logging handler that hands formatted records to an ArchiveWriter instead of writing to disk"""
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        try:
+            self.writer.put(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
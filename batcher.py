@@ -0,0 +1,83 @@
+import time
+import asyncio
+
+class Batch:
+    """Requests collected under one key, flushed together as a single upstream call"""
+
+    def __init__(self, key, owner):
+        self.key = key
+        self.owner = owner
+        self.sizes = []
+        self.total = 0
+        self.opened = time.monotonic()
+        self.timer = None
+        self.ready = asyncio.get_running_loop().create_future()
+        # Mark errors as retrieved even if every waiter has gone away
+        self.ready.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+class MicroBatcher:
+    """
+    Merges requests with the same key that arrive close together.
+    A batch stays open for `window` seconds after its latest request, but never
+    longer than `max_wait` after its first, and is flushed straight away once it
+    holds `max_size` units. Flushing calls on_flush(batch) and hands its return
+    value (e.g. a scheduler job) to every request in the batch.
+    """
+
+    def __init__(self, window, max_wait, max_size, on_flush):
+        self.window = window
+        self.max_wait = max_wait
+        self.max_size = max_size
+        self.on_flush = on_flush
+        self.open = {}
+        self.batches = 0
+        self.requests = 0
+
+    async def join(self, key, size, owner=None):
+        """
+        Add a request of `size` units under `key` and wait for its batch to flush.
+        Returns (flush result, start, stop), where start:stop is this request's slice of the batch.
+        """
+        batch = self.open.get(key)
+        if batch is not None and batch.total + size > self.max_size:
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = Batch(key, owner)
+            self.open[key] = batch
+
+        start = batch.total
+        batch.sizes.append(size)
+        batch.total += size
+        self.requests += 1
+
+        if batch.total >= self.max_size:
+            self._flush(key)
+        else:
+            if batch.timer is not None:
+                batch.timer.cancel()
+            delay = max(0, min(self.window, batch.opened + self.max_wait - time.monotonic()))
+            batch.timer = asyncio.get_running_loop().call_later(delay, self._flush, key)
+
+        result = await asyncio.shield(batch.ready)
+        return result, start, start + size
+
+    def _flush(self, key):
+        batch = self.open.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        self.batches += 1
+        try:
+            batch.ready.set_result(self.on_flush(batch))
+        except Exception as e:
+            batch.ready.set_exception(e)
+
+    def close(self):
+        """Fail every batch that hasn't been flushed yet"""
+        for batch in self.open.values():
+            if batch.timer is not None:
+                batch.timer.cancel()
+            batch.ready.cancel()
+        self.open.clear()
@@ -0,0 +1,135 @@
+"""
+Offline benchmark and load-test harness.
+
+Runs the real bot, cogs and discord.py command machinery against fake Discord objects and local
+stand-ins for the Gemini and RetroDiffusion APIs. Needs no token, no API keys and no network, only
+the bot's requirements and the openssl binary (for the Gemini stand-in's TLS certificate).
+
+    python -m bench                                   # every scenario with default sizes
+    python -m bench -s mixed -n 5000 -c 100           # one scenario, bigger and more concurrent
+    python -m bench --save baseline.json              # record a baseline
+    python -m bench --baseline baseline.json          # compare a change against it
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args():
+    from bench.scenarios import SCENARIOS
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Offline benchmark for the bot's hot paths")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("-n", "--count", type=int, default=500, help="Events per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=50, help="Events in flight at once")
+    parser.add_argument("--guilds", type=int, default=3)
+    parser.add_argument("--channels", type=int, default=4, help="Channels per guild")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="Simulated Discord REST round trip (s)")
+    parser.add_argument("--gemini-latency", type=float, default=0.8, help="Gemini stand-in latency (s)")
+    parser.add_argument("--retro-latency", type=float, default=1.5, help="RetroDiffusion stand-in latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of upstream requests that fail")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report tracemalloc peak (slower)")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved earlier with --save")
+    return parser.parse_args()
+
+def print_report(report, baseline=None):
+    def delta(key, higher_is_better):
+        if not baseline or key not in baseline or not baseline[key]:
+            return ""
+        change = (report[key] - baseline[key]) / baseline[key] * 100
+        better = change > 0 if higher_is_better else change < 0
+        return f" ({change:+.1f}% {'better' if better else 'worse'})"
+
+    print(f"\n== {report['scenario']} ==")
+    print(f"  events:      {report['events']} in {report['seconds']:.2f}s, {report['failures']} failed")
+    print(f"  throughput:  {report['events_per_second']:.1f} events/s{delta('events_per_second', True)}")
+    print(f"  latency:     p50 {report['p50_ms']:.1f}ms{delta('p50_ms', False)}, "
+          f"p99 {report['p99_ms']:.1f}ms{delta('p99_ms', False)}")
+    for label, stats in report["by_label"].items():
+        print(f"    {label:<10} x{stats['count']:<6} p50 {stats['p50_ms']:.1f}ms  p99 {stats['p99_ms']:.1f}ms")
+    print(f"  REST calls:  {report['rest_calls']}")
+    if report.get("rss_growth_mb") is not None:
+        memory = f"  memory:      {report['rss_growth_mb']:+.1f} MiB RSS during the scenario ({report['rss_mb']:.1f} MiB after)"
+        if baseline and baseline.get("rss_growth_mb") is not None:
+            # Growth can be zero or negative, so compare in MiB rather than percent
+            memory += f", {report['rss_growth_mb'] - baseline['rss_growth_mb']:+.1f} MiB vs baseline"
+    else:
+        memory = "  memory:      RSS not available on this platform"
+    if report["traced_peak_mb"] is not None:
+        memory += f", {report['traced_peak_mb']:.1f} MiB traced peak"
+    print(memory)
+
+async def run(args):
+    from bench.standins import UpstreamProfile, RetroStandIn, GeminiStandIn
+
+    gemini = GeminiStandIn(UpstreamProfile(args.gemini_latency, args.gemini_latency / 4, args.error_rate), os.getcwd())
+    retro = RetroStandIn(UpstreamProfile(args.retro_latency, args.retro_latency / 4, args.error_rate))
+    await gemini.start()
+    await retro.start()
+
+    # config reads these at import time, so point it at the stand-ins before importing the bot
+    os.environ.update({
+        "APIKEY": "bench-token",
+        "GEMINI_API": "bench-gemini-key",
+        "RETRODIFF_API": "bench-retro-key",
+        "GEMINI_API_ENDPOINT": gemini.endpoint,
+        "RETRO_API_URL": retro.url,
+    })
+    import config
+    # Simulated users ask far more often than real ones; cogs read config when they load, below
+    config.GEMINI_COOLDOWN = config.RETRO_COOLDOWN = 0
+    import main as bot_main
+    from utils import start_archives, close_archives
+    from bench.fakes import FakeHTTP, FakeUser
+    from bench.scenarios import Harness, SCENARIOS, run_scenario
+
+    bot = bot_main.bot
+    reports = []
+    start_archives()
+    try:
+        async with bot:
+            # Pretend we're logged in
+            bot._connection.user = FakeUser("RaceCarbot", bot=True)
+            await bot_main.load_extensions()
+
+            harness = Harness(bot, FakeHTTP(latency=args.rest_latency, jitter=args.rest_latency / 2),
+                              guilds=args.guilds, channels_per_guild=args.channels, users=args.users)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                for name in args.scenario or list(SCENARIOS):
+                    reports.append(await run_scenario(harness, name, args.count, args.concurrency, args.trace_memory))
+    finally:
+        await close_archives()
+        await retro.stop()
+        await gemini.stop()
+    return reports
+
+def main():
+    sys.path.insert(0, REPO_ROOT)
+    args = parse_args()
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = {report["scenario"]: report for report in json.load(file)}
+    save_path = os.path.abspath(args.save) if args.save else None
+
+    # Logs, caches and archives go to a scratch directory, not the working tree
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        os.chdir(workdir)
+        reports = asyncio.run(run(args))
+
+    for report in reports:
+        print_report(report, baseline.get(report["scenario"]))
+    if save_path:
+        with open(save_path, "w", encoding="utf-8") as file:
+            json.dump(reports, file, indent=2)
+        print(f"\nSaved results to {save_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Stand-ins for the Discord objects the bot touches, so commands run end to end without a gateway.
+Replies go through discord.py's real Messageable.send / Typing code and land in FakeHTTP,
+which adds a configurable REST latency and counts every call by route.
+"""
+import asyncio
+import datetime
+import itertools
+import random
+from collections import Counter
+
+_ids = itertools.count(10**17)
+
+def next_id():
+    return next(_ids)
+
+class FakeHTTP:
+    """Counts REST calls and sleeps for a simulated round trip on each one"""
+
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+
+    async def request(self, route):
+        self.calls[route] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def send_message(self, channel_id, *, params):
+        await self.request("send_message")
+        # Messages with attachments are multipart and carry no JSON payload
+        return {"id": next_id(), "channel_id": channel_id, "payload": params.payload or {}}
+
+    async def send_typing(self, channel_id):
+        await self.request("send_typing")
+
+class FakeState:
+    """The parts of discord.py's ConnectionState that sending a message needs"""
+
+    def __init__(self, http, bot_user):
+        self.http = http
+        self.bot_user = bot_user
+        self.loop = asyncio.get_running_loop()
+        self.allowed_mentions = None
+
+    def create_message(self, *, channel, data):
+        return FakeMessage(self, data["id"], self.bot_user, channel, data["payload"].get("content") or "")
+
+class FakeUser:
+    def __init__(self, name, bot=False, user_id=None):
+        self.id = user_id or next_id()
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+        self.avatar = None
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+class FakeGuild:
+    def __init__(self, name):
+        self.id = next_id()
+        self.name = name
+        self.members = []
+        self.roles = []
+        self.member_count = 0
+
+class FakeChannel:
+    def __init__(self, state, guild, name):
+        self._state = state
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+
+    async def _get_channel(self):
+        return self
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self._state, message_id, self._state.bot_user, self, "")
+
+    async def fetch_message(self, message_id):
+        await self._state.http.request("fetch_message")
+        return FakeMessage(self._state, message_id, self._state.bot_user, self, "")
+
+    async def send(self, content=None, **kwargs):
+        await self._state.http.request("send_message")
+        return FakeMessage(self._state, next_id(), self._state.bot_user, self, content or "")
+
+class FakeMessage:
+    def __init__(self, state, message_id, author, channel, content):
+        self._state = state
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.attachments = []
+        self.embeds = []
+        self.mentions = []
+        self.role_mentions = []
+        self.reference = None
+        self.webhook_id = None
+        self.type = None
+        self.edited_at = None
+
+    async def add_reaction(self, emoji):
+        await self._state.http.request("add_reaction")
+
+    async def edit(self, **kwargs):
+        await self._state.http.request("edit_message")
+        if "content" in kwargs:
+            self.content = kwargs["content"] or ""
+        return self
+
+    async def delete(self, *, delay=None):
+        await self._state.http.request("delete_message")
+
+def edited(message, content):
+    """A copy of message with new content, as on_message_edit would receive it"""
+    message = FakeMessage(message._state, message.id, message.author, message.channel, content)
+    message.edited_at = datetime.datetime.now(datetime.timezone.utc)
+    return message
@@ -0,0 +1,201 @@
+"""
+Benchmark scenarios. Each one builds a list of (label, action) pairs, where action() feeds one
+fake event into the bot and returns how long the bot took to handle it.
+"""
+import time
+import random
+import asyncio
+import os
+import tracemalloc
+from collections import defaultdict
+from bench.fakes import FakeState, FakeUser, FakeGuild, FakeChannel, FakeMessage, edited, next_id
+
+class Harness:
+    """A fake gateway: a few guilds, channels and users that messages are delivered from"""
+
+    def __init__(self, bot, http, guilds=3, channels_per_guild=4, users=50):
+        self.bot = bot
+        self.http = http
+        self.state = FakeState(http, bot.user)
+        self.guilds = [FakeGuild(f"guild-{i}") for i in range(guilds)]
+        self.channels = [FakeChannel(self.state, guild, f"channel-{i}")
+                         for guild in self.guilds for i in range(channels_per_guild)]
+        self.users = [FakeUser(f"user-{i}") for i in range(users)]
+        # discord.py logs errors in event handlers and carries on; re-raise so they count as failures
+        async def on_error(event, *args, **kwargs):
+            raise
+        bot.on_error = on_error
+
+    def message(self, content, channel=None, author=None):
+        return FakeMessage(
+            self.state,
+            next_id(),
+            author or random.choice(self.users),
+            channel or random.choice(self.channels),
+            content,
+        )
+
+    async def dispatch(self, event, *args):
+        """
+        Dispatch a gateway event the way discord.py does, so cog listeners (e.g. history ingestion)
+        run as well as the bot's own handler, and wait for every handler it started
+        """
+        before = asyncio.all_tasks()
+        self.bot.dispatch(event, *args)
+        # dispatch() only schedules tasks, so everything new since it was called is one of its handlers
+        await asyncio.gather(*(asyncio.all_tasks() - before))
+
+    async def deliver(self, message):
+        start = time.perf_counter()
+        await self.dispatch("message", message)
+        return time.perf_counter() - start
+
+    async def edit(self, message, content):
+        """Deliver an edit and wait until it has been reprocessed (debounce window included)"""
+        start = time.perf_counter()
+        await self.dispatch("message_edit", message, edited(message, content))
+        pending = self.bot.pending_edits.get(message.id)
+        if pending is not None:
+            await pending
+        return time.perf_counter() - start
+
+def _deliver(harness, label, content):
+    return label, lambda: harness.deliver(harness.message(content))
+
+def chatter(harness, count):
+    """Plain messages with no command: the on_message hot path"""
+    return [_deliver(harness, "chatter", f"just chatting about lap times #{i}") for i in range(count)]
+
+def light(harness, count):
+    """Cheap commands that only talk to Discord"""
+    commands = ["!hello", "!flip", "!ping"]
+    return [_deliver(harness, commands[i % 3][1:], commands[i % 3]) for i in range(count)]
+
+def ask(harness, count):
+    """!ask with a distinct question each time, so every call reaches the Gemini stand-in"""
+    return [_deliver(harness, "ask", f"!ask what is the fastest pit stop strategy number {next_id()}?") for _ in range(count)]
+
+def ask_repeat(harness, count):
+    """!ask drawn from a small set of questions, so most calls can be answered from cache"""
+    return [_deliver(harness, "ask", f"!ask what is a racing line {i % 5}") for i in range(count)]
+
+def retro(harness, count):
+    """!retro with a distinct prompt each time, so every call reaches the RetroDiffusion stand-in"""
+    return [_deliver(harness, "retro", f"!retro pixel art race car number {next_id()}") for _ in range(count)]
+
+def edits(harness, count):
+    """Edits of messages that already ran a command: reply cleanup plus re-running the command"""
+    actions = []
+    for _ in range(count):
+        message = harness.message("!flip")
+        async def action(message=message):
+            await harness.deliver(message)
+            return await harness.edit(message, "!hello")
+        actions.append(("edit", action))
+    return actions
+
+def edit_bursts(harness, count):
+    """!ask fixed up with several quick edits: only the last version should reach the Gemini stand-in"""
+    actions = []
+    for _ in range(count):
+        message = harness.message(f"!ask what is a tyre {next_id()}")
+        async def action(message=message):
+            asyncio.ensure_future(harness.deliver(message))
+            await asyncio.sleep(0.05)
+            for _ in range(2):
+                await harness.dispatch("message_edit", message, edited(message, f"!ask what is a tyre {next_id()}"))
+                await asyncio.sleep(0.05)
+            return await harness.edit(message, f"!ask what is a tyre compound {next_id()}")
+        actions.append(("edit_burst", action))
+    return actions
+
+def mixed(harness, count):
+    """Roughly what a busy server looks like: mostly chatter, some commands, a few upstream calls"""
+    builders = [(chatter, 0.80), (light, 0.15), (ask, 0.03), (retro, 0.02)]
+    actions = []
+    for builder, share in builders:
+        actions.extend(builder(harness, max(1, int(count * share))))
+    random.shuffle(actions)
+    return actions
+
+SCENARIOS = {
+    "chatter": chatter,
+    "light": light,
+    "ask": ask,
+    "ask_repeat": ask_repeat,
+    "retro": retro,
+    "edits": edits,
+    "edit_bursts": edit_bursts,
+    "mixed": mixed,
+}
+
+def current_rss_mb():
+    """Resident memory right now (ru_maxrss is the process's all-time peak, useless per scenario)"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run_scenario(harness, name, count, concurrency, trace_memory=False):
+    """Run one scenario with at most `concurrency` events in flight and return its report"""
+    actions = SCENARIOS[name](harness, count)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = defaultdict(list)
+    failures = 0
+    calls_before = dict(harness.http.calls)
+
+    async def run(label, action):
+        nonlocal failures
+        async with semaphore:
+            try:
+                latencies[label].append(await action())
+            except Exception:
+                failures += 1
+
+    rss_before = current_rss_mb()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(run(label, action) for label, action in actions))
+    elapsed = time.perf_counter() - start
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    rss_after = current_rss_mb()
+
+    everything = [value for values in latencies.values() for value in values]
+    rest_calls = {route: harness.http.calls[route] - calls_before.get(route, 0) for route in harness.http.calls}
+    return {
+        "scenario": name,
+        "events": len(actions),
+        "failures": failures,
+        "seconds": elapsed,
+        "events_per_second": len(actions) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(everything, 0.50) * 1000,
+        "p99_ms": percentile(everything, 0.99) * 1000,
+        "by_label": {
+            label: {
+                "count": len(values),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+            }
+            for label, values in sorted(latencies.items())
+        },
+        "rest_calls": {route: n for route, n in sorted(rest_calls.items()) if n},
+        "rss_mb": rss_after,
+        "rss_growth_mb": rss_after - rss_before if rss_after is not None else None,
+        "traced_peak_mb": traced_peak / (1024 * 1024) if traced_peak is not None else None,
+    }
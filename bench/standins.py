@@ -0,0 +1,154 @@
+"""
+Local servers that mimic the upstream APIs, with configurable latency and error injection.
+The RetroDiffusion stand-in is plain HTTP. The Gemini stand-in speaks the same gRPC service
+the google-generativeai client uses, over TLS with a throwaway self-signed certificate.
+"""
+import os
+import random
+import asyncio
+import subprocess
+from aiohttp import web
+
+# 1x1 transparent PNG
+TINY_PNG_BASE64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+
+class UpstreamProfile:
+    """How a stand-in behaves: base latency, random jitter on top, and the share of requests that fail"""
+
+    def __init__(self, latency=0.5, jitter=0.1, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+
+    async def delay(self, scale=1.0):
+        await asyncio.sleep((self.latency + random.uniform(0, self.jitter)) * scale)
+
+    def should_fail(self):
+        self.requests += 1
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+class RetroStandIn:
+    """Answers POSTs like the RetroDiffusion inference endpoint"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self._runner = None
+        self.url = None
+
+    async def handle(self, request):
+        payload = await request.json()
+        await self.profile.delay()
+        if self.profile.should_fail():
+            return web.json_response({"detail": "Injected upstream error"}, status=500)
+        return web.json_response({
+            "base64_images": [TINY_PNG_BASE64] * int(payload.get("num_images", 1)),
+            "model": payload.get("model", "RD_FLUX"),
+            "credit_cost": 1,
+            "remaining_credits": 999,
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/{tail:.*}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/v1/inferences"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+def make_self_signed_cert(directory):
+    """
+    Create a certificate for localhost and make gRPC trust it.
+    Must run before the Gemini client opens its first channel.
+    """
+    key_path = os.path.join(directory, "standin.key")
+    cert_path = os.path.join(directory, "standin.crt")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key_path, "-out", cert_path,
+         "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+        check=True, capture_output=True,
+    )
+    os.environ["GRPC_DEFAULT_SSL_ROOTS_FILE_PATH"] = cert_path
+    return key_path, cert_path
+
+class GeminiStandIn:
+    """Serves GenerateContent and StreamGenerateContent like the Gemini API"""
+
+    SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+    def __init__(self, profile, cert_dir, answer_words=120, stream_chunks=8):
+        self.profile = profile
+        self.cert_dir = cert_dir
+        self.answer_words = answer_words
+        self.stream_chunks = stream_chunks
+        self._server = None
+        self.endpoint = None
+
+    def _answer(self, request):
+        question = request.contents[-1].parts[0].text if request.contents else ""
+        words = [f"word{i}" for i in range(self.answer_words)]
+        return f"Stand-in answer to: {question}\n" + " ".join(words)
+
+    def _response(self, text, final):
+        from google.ai import generativelanguage_v1beta as glm
+        finish_reason = glm.Candidate.FinishReason.STOP if final else glm.Candidate.FinishReason.FINISH_REASON_UNSPECIFIED
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(
+            content=glm.Content(parts=[glm.Part(text=text)], role="model"),
+            finish_reason=finish_reason,
+            index=0,
+        )])
+
+    async def generate(self, request, context):
+        import grpc
+        await self.profile.delay()
+        if self.profile.should_fail():
+            await context.abort(grpc.StatusCode.INTERNAL, "Injected upstream error")
+        return self._response(self._answer(request), True)
+
+    async def stream(self, request, context):
+        import grpc
+        if self.profile.should_fail():
+            await self.profile.delay()
+            await context.abort(grpc.StatusCode.INTERNAL, "Injected upstream error")
+        text = self._answer(request)
+        size = max(1, len(text) // self.stream_chunks + 1)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        for i, piece in enumerate(pieces):
+            # Spread the total latency over the chunks, like a model generating tokens
+            await self.profile.delay(1 / len(pieces))
+            yield self._response(piece, i == len(pieces) - 1)
+
+    async def start(self):
+        key_path, cert_path = make_self_signed_cert(self.cert_dir)
+        import grpc
+        from google.ai import generativelanguage_v1beta as glm
+
+        request_type = glm.GenerateContentRequest
+        response_type = glm.GenerateContentResponse
+        handler = grpc.method_handlers_generic_handler(self.SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                self.generate, request_deserializer=request_type.deserialize, response_serializer=response_type.serialize),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                self.stream, request_deserializer=request_type.deserialize, response_serializer=response_type.serialize),
+        })
+        self._server = grpc.aio.server()
+        self._server.add_generic_rpc_handlers((handler,))
+        with open(key_path, "rb") as key_file, open(cert_path, "rb") as cert_file:
+            credentials = grpc.ssl_server_credentials([(key_file.read(), cert_file.read())])
+        port = self._server.add_secure_port("127.0.0.1:0", credentials)
+        await self._server.start()
+        self.endpoint = f"localhost:{port}"
+
+    async def stop(self):
+        if self._server is not None:
+            await self._server.stop(0)
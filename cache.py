@@ -0,0 +1,133 @@
+import os
+import json
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    A dict-like cache bounded by entry count, total size and entry age.
+    Least recently used entries are evicted first once maxsize (or max_bytes,
+    measured with sizeof) is reached, and entries older than ttl seconds are
+    treated as missing.
+    """
+
+    def __init__(self, maxsize=1000, ttl=None, max_bytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, expires_at, size)
+        self._data = OrderedDict()
+
+    def _expired(self, expires_at, now=None):
+        return expires_at is not None and (now or time.monotonic()) >= expires_at
+
+    def _remove(self, key):
+        _, _, size = self._data.pop(key)
+        self.total_bytes -= size
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if self._expired(entry[1]):
+            self._remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, expires_at=None):
+        if key in self._data:
+            self._remove(key)
+        if expires_at is None and self.ttl:
+            expires_at = time.monotonic() + self.ttl
+        size = self.sizeof(value)
+        self._data[key] = (value, expires_at, size)
+        self.total_bytes += size
+        self._evict()
+
+    def pop(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        self._remove(key)
+        return default if self._expired(entry[1]) else entry[0]
+
+    def purge(self):
+        """Drop every expired entry"""
+        now = time.monotonic()
+        for key, (_, expires_at, _) in list(self._data.items()):
+            if self._expired(expires_at, now):
+                self._remove(key)
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def _evict(self):
+        # Expired entries sit in insertion order too, so the oldest go first either way
+        while self._data and (len(self._data) > self.maxsize or
+                              (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            self._remove(next(iter(self._data)))
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def save(self, path):
+        """Write unexpired entries to a JSON file (keys and values must be JSON-serializable)"""
+        self.purge()
+        now_mono, now_wall = time.monotonic(), time.time()
+        entries = [
+            [key, value, None if expires_at is None else now_wall + (expires_at - now_mono)]
+            for key, (value, expires_at, _) in self._data.items()
+        ]
+        # Per-process temp name, so cluster workers sharing the file don't clobber each other mid-write
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, path)
+
+    def load(self, path, overwrite=True):
+        """
+        Load entries written by save(), skipping any that expired meanwhile.
+        With overwrite=False, keys already in the cache keep their current value.
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as file:
+            entries = json.load(file)
+        now_mono, now_wall = time.monotonic(), time.time()
+        for key, value, expires_wall in entries:
+            if expires_wall is not None and expires_wall <= now_wall:
+                continue
+            if not overwrite and key in self._data:
+                continue
+            self.set(key, value, None if expires_wall is None else now_mono + (expires_wall - now_wall))
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and not self._expired(entry[1])
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self._remove(key)
+
+    def __len__(self):
+        return len(self._data)
+
+_MISSING = object()
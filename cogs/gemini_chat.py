@@ -1,12 +1,283 @@
 import discord
 from discord.ext import commands
-import google.generativeai as genai
+import asyncio
+import importlib
+import time
+import hashlib
+import json
+import re
+import unicodedata
+from collections import OrderedDict, deque
 from config import *
+from admission import admission, AdmissionError
+from cache import TTLCache
+from metrics import metrics
 from utils import react_with_random_emoji, log_error
 
+SYSTEM_INSTRUCTION = "You are a very smart AI, u intellectually explain whatever i ask or give me all the info i need. use concise short intuitive summaries, use less words if needed.You URL links and sources blogs and such, based on the query"
+
+def normalize_prompt(text):
+    """Fold case, width and whitespace so trivially different wordings share a cache entry"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.")
+
+def is_upstream_failure(error):
+    """Rejected requests (4xx other than 429) and blocked or unfinished answers say nothing about Gemini's health"""
+    if isinstance(error, ValueError):
+        return False
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and 400 <= code < 500:
+        return code == 429
+    return True
+
+def chunk_text(chunk):
+    """Text of a streamed chunk; chunks without text (e.g. a final safety verdict) count as empty"""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def check_finished(response, answer):
+    """
+    Raise ValueError, as response.text does for a non-streamed answer, if the answer came back
+    empty or stopped for any reason other than finishing (safety, recitation, max tokens...),
+    so a blocked or cut-off answer is never shown or cached as complete
+    """
+    reason = response.candidates[0].finish_reason if response is not None and response.candidates else None
+    if not answer.strip() or reason is None or reason.name != "STOP":
+        raise ValueError(f"Gemini didn't finish its answer (finish reason: {reason.name if reason is not None else 'none'})")
+
+def split_text(text, limit):
+    """Split text into pieces of at most limit characters, preferring line and word breaks"""
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        pages.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    pages.append(text)
+    return pages
+
+class PagedReply:
+    """
+    A Gemini answer spread over as many embeds as it needs.
+    render() edits only the pages whose text changed and sends new messages for
+    overflow; update() is the throttled version used while a response streams in, and
+    edits in the background so the stream is never held up by Discord.
+    """
+
+    def __init__(self, ctx, model_name):
+        self.ctx = ctx
+        self.model_name = model_name
+        self.messages = []
+        self.rendered = []
+        self.last_render = 0
+        # The streamed edit in flight, if any
+        self.editing = None
+
+    def _embed(self, page, index, final):
+        embed = discord.Embed(
+            title="💭 Gemini AI Response" if index == 0 else "💭 Gemini AI Response (continued)",
+            description=page or "✍️ Thinking...",
+            color=discord.Color.blue()
+        )
+        embed.set_footer(text=f"Model: {self.model_name}" if final else "✍️ Generating...")
+        return embed
+
+    async def render(self, text, final=False):
+        # Let a streamed edit land first, so it can't overwrite this one
+        await self.settle()
+        await self._render(text, final)
+
+    async def _render(self, text, final=False):
+        pages = split_text(text, GEMINI_EMBED_PAGE_SIZE)
+        for index, page in enumerate(pages):
+            # Only the last page's footer changes when the answer completes
+            state = (page, final and index == len(pages) - 1)
+            if index < len(self.messages):
+                if self.rendered[index] != state:
+                    await self.messages[index].edit(embed=self._embed(page, index, state[1]))
+                    self.rendered[index] = state
+            else:
+                self.messages.append(await self.ctx.send(embed=self._embed(page, index, state[1])))
+                self.rendered.append(state)
+        self.last_render = time.monotonic()
+
+    def update(self, text):
+        # One edit in flight at a time; the next chunk after it (or the final render) catches up
+        if self.editing is not None:
+            if not self.editing.done():
+                return
+            # Surface a failed edit the way an awaited one would
+            self.editing.result()
+        # The first text goes out straight away; later edits stay well inside Discord's per-channel edit rate limit
+        shown = self.rendered and self.rendered[0][0]
+        if not shown or time.monotonic() - self.last_render >= GEMINI_STREAM_EDIT_INTERVAL:
+            self.editing = asyncio.create_task(self._render(text))
+
+    async def settle(self):
+        """Wait for the streamed edit in flight, if any"""
+        editing, self.editing = self.editing, None
+        if editing is not None:
+            await editing
+
+    def cancel(self):
+        """Drop the streamed edit in flight, for an answer that was abandoned"""
+        if self.editing is not None:
+            self.editing.cancel()
+
+    async def fail(self, message):
+        """Replace whatever has been shown (or the placeholder) with an error; sent as a message if nothing was shown"""
+        # An edit that failed mid-stream is superseded by this one anyway
+        await asyncio.gather(self.settle(), return_exceptions=True)
+        if not self.messages:
+            await self.ctx.send(message)
+            return
+        await self.messages[0].edit(embed=discord.Embed(description=message, color=discord.Color.red()))
+        for extra in self.messages[1:]:
+            await extra.delete()
+        del self.messages[1:], self.rendered[1:]
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token), good enough for budgeting without an API call"""
+    return len(text) // 4 + 1
+
+class Conversation:
+    """What one channel or user has talked about: a rolling summary of older turns plus recent ones verbatim"""
+
+    def __init__(self):
+        self.summary = ""
+        # (question, answer) pairs, oldest first
+        self.turns = deque()
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        # Background task folding old turns into the summary, if one is running
+        self.compaction = None
+
+    def is_empty(self):
+        return not self.summary and not self.turns
+
+    def tokens(self):
+        return estimate_tokens(self.summary) + sum(estimate_tokens(q) + estimate_tokens(a) for q, a in self.turns)
+
+    def history(self, verbatim_budget):
+        """
+        Gemini chat history for the next question: the summary as an opening exchange, then
+        the newest turns that fit the budget (older ones may still be waiting for compaction)
+        """
+        recent = []
+        tokens = 0
+        for question, answer in reversed(self.turns):
+            tokens += estimate_tokens(question) + estimate_tokens(answer)
+            if recent and tokens > verbatim_budget:
+                break
+            recent.append((question, answer))
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [f"Summary of our conversation so far: {self.summary}"]})
+            history.append({"role": "model", "parts": ["Got it, I'll keep that in mind."]})
+        for question, answer in reversed(recent):
+            history.append({"role": "user", "parts": [question]})
+            history.append({"role": "model", "parts": [answer]})
+        return history
+
+class ConversationMemory:
+    """
+    Token-budgeted conversation memory, one Conversation per key.
+    Recent turns are kept verbatim within the budget left after the summary's share; once
+    they outgrow it, add() hands back the oldest half for compaction into the summary.
+    Idle conversations expire, and the least recently used go first once max_conversations
+    is reached. Memory is opt-in per key (see set_enabled); keys without it ask statelessly.
+    """
+
+    def __init__(self, max_conversations, idle_timeout, token_budget, summary_tokens, default_enabled=False):
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.default_enabled = default_enabled
+        # key -> Conversation, least recently used first
+        self.conversations = OrderedDict()
+        # key -> memory on/off, for keys that changed it from the default
+        self.settings = {}
+
+    @property
+    def verbatim_budget(self):
+        return self.token_budget - self.summary_tokens
+
+    def is_enabled(self, key):
+        return self.settings.get(key, self.default_enabled)
+
+    def set_enabled(self, key, enabled):
+        """Turn memory on or off for a key; turning it off forgets the conversation"""
+        if enabled == self.default_enabled:
+            self.settings.pop(key, None)
+        else:
+            self.settings[key] = enabled
+        if not enabled:
+            self.forget(key)
+
+    def _expire(self, now):
+        for key, conversation in list(self.conversations.items()):
+            if now - conversation.last_used > self.idle_timeout and not conversation.lock.locked():
+                del self.conversations[key]
+
+    def _evict(self):
+        # Drop the least recently used conversations that aren't answering right now
+        for key, conversation in list(self.conversations.items()):
+            if len(self.conversations) < self.max_conversations:
+                break
+            if not conversation.lock.locked():
+                del self.conversations[key]
+
+    def get(self, key):
+        now = time.monotonic()
+        self._expire(now)
+        conversation = self.conversations.get(key)
+        if conversation is None:
+            self._evict()
+            conversation = self.conversations[key] = Conversation()
+        else:
+            self.conversations.move_to_end(key)
+        conversation.last_used = now
+        return conversation
+
+    def forget(self, key):
+        """Drop a conversation; returns whether there was one"""
+        return self.conversations.pop(key, None) is not None
+
+    def add(self, conversation, question, answer):
+        """
+        Record a turn. Once the turns outgrow the verbatim budget (and no compaction is running),
+        return the oldest of them, enough to bring the rest down to half the budget, to be folded
+        into the summary; they stay in place until that's done. Compacting half the budget at a
+        time means one summarizer call every few questions rather than one per question.
+        The newest turn always stays, cut down if it alone is too long.
+        """
+        answer = answer[:max(0, self.verbatim_budget - estimate_tokens(question)) * 4]
+        conversation.turns.append((question, answer))
+        sizes = [estimate_tokens(q) + estimate_tokens(a) for q, a in conversation.turns]
+        tokens = sum(sizes)
+        if conversation.compaction is not None or tokens <= self.verbatim_budget:
+            return []
+        overflow = []
+        for turn, size in zip(list(conversation.turns)[:-1], sizes):
+            if tokens <= self.verbatim_budget // 2:
+                break
+            overflow.append(turn)
+            tokens -= size
+        return overflow
+
+    def __len__(self):
+        return len(self.conversations)
+
 class GeminiChat(commands.Cog):
     """Cog for interacting with Google's Gemini AI model"""
-    
+
     def __init__(self, bot):
         self.bot = bot
         self.api_key = GEMINI_API_KEY
@@ -18,7 +289,128 @@ class GeminiChat(commands.Cog):
             "max_output_tokens": 8192,
             "response_mime_type": "text/plain",
         }
-        
+        self.system_instruction = SYSTEM_INSTRUCTION
+
+        # Built on first use, then kept for the cog's lifetime
+        self.model = None
+        self.summarizer = None
+        self._model_lock = asyncio.Lock()
+        self.memory = ConversationMemory(
+            max_conversations=GEMINI_MAX_CONVERSATIONS,
+            idle_timeout=GEMINI_CONVERSATION_IDLE_TIMEOUT,
+            token_budget=GEMINI_MEMORY_TOKEN_BUDGET,
+            summary_tokens=GEMINI_SUMMARY_MAX_TOKENS,
+            default_enabled=GEMINI_MEMORY_DEFAULT,
+        )
+        # Running compactions (asyncio only keeps weak references to tasks)
+        self.compactions = set()
+        self.upstream = admission.upstream(
+            "gemini",
+            label="Gemini",
+            max_concurrency=GEMINI_MAX_CONCURRENCY,
+            target_latency=GEMINI_TARGET_LATENCY,
+            cooldown=GEMINI_COOLDOWN,
+            max_waiting=ADMISSION_MAX_WAITING,
+            wait_timeout=ADMISSION_WAIT_TIMEOUT,
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=BREAKER_RESET_TIMEOUT,
+            is_failure=is_upstream_failure,
+        )
+        # Set once export_state() has given the memory and caches to a reloaded instance
+        self.handed_off = False
+        self.response_cache = TTLCache(
+            maxsize=GEMINI_CACHE_SIZE,
+            ttl=GEMINI_CACHE_TTL,
+            max_bytes=GEMINI_CACHE_MAX_BYTES,
+            sizeof=lambda text: len(text.encode("utf-8")),
+        )
+
+    async def cog_load(self):
+        """Restore the response cache saved by a previous run"""
+        state = self.bot.cog_state.pop(self.qualified_name, None)
+        if state is not None:
+            self.import_state(state)
+            return
+        if GEMINI_CACHE_FILE:
+            try:
+                await asyncio.to_thread(self.response_cache.load, GEMINI_CACHE_FILE)
+            except Exception as e:
+                log_error(f"Could not load Gemini response cache: {str(e)}")
+
+    async def cog_unload(self):
+        """Persist the response cache so it survives restarts"""
+        if GEMINI_CACHE_FILE and not self.handed_off:
+            try:
+                # Keep what other cluster workers saved to the same file since we loaded it
+                await asyncio.to_thread(self.response_cache.load, GEMINI_CACHE_FILE, False)
+                await asyncio.to_thread(self.response_cache.save, GEMINI_CACHE_FILE)
+            except Exception as e:
+                log_error(f"Could not save Gemini response cache: {str(e)}")
+
+    def export_state(self):
+        """Hand conversations, the answer cache and the built models to the instance replacing this one on reload"""
+        self.handed_off = True
+        return {
+            "memory": self.memory,
+            "response_cache": self.response_cache,
+            "model": self.model,
+            "summarizer": self.summarizer,
+            "compactions": self.compactions,
+        }
+
+    def import_state(self, state):
+        self.memory = state["memory"]
+        self.response_cache = state["response_cache"]
+        self.model = state["model"]
+        self.summarizer = state["summarizer"]
+        self.compactions = state["compactions"]
+
+    async def get_model(self):
+        """
+        Import the Gemini SDK, configure it and build the model the first time it's needed.
+        The SDK is slow to import, so this keeps it off the startup path and off the event loop.
+        """
+        if self.model is None:
+            async with self._model_lock:
+                if self.model is None:
+                    genai = await asyncio.to_thread(importlib.import_module, "google.generativeai")
+                    client_options = {"api_endpoint": GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None
+                    genai.configure(api_key=self.api_key, client_options=client_options)
+                    self.summarizer = genai.GenerativeModel(
+                        model_name=self.model_name,
+                        generation_config={"temperature": 0.2, "max_output_tokens": GEMINI_SUMMARY_MAX_TOKENS},
+                    )
+                    self.model = genai.GenerativeModel(
+                        model_name=self.model_name,
+                        generation_config=self.generation_config,
+                        system_instruction=self.system_instruction,
+                    )
+        return self.model
+
+    def cache_key(self, question):
+        """
+        Hash of the normalized question plus everything else that shapes the answer.
+        Only answers given without conversation history are cached under it; the "stateless"
+        marker keeps entries saved by versions that cached answers from chat sessions out of use.
+        """
+        material = json.dumps(
+            ["stateless", normalize_prompt(question), self.model_name, self.generation_config, self.system_instruction],
+            sort_keys=True,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def session_key(self, ctx):
+        """Conversations are shared per channel or per user, depending on config"""
+        if GEMINI_SESSION_SCOPE == "user":
+            return ("user", ctx.author.id)
+        return ("channel", ctx.channel.id)
+
+    def may_change_memory(self, ctx):
+        """A channel's conversation belongs to everyone in it, so only moderators may switch it off or wipe it"""
+        if GEMINI_SESSION_SCOPE == "user" or ctx.guild is None:
+            return True
+        return ctx.channel.permissions_for(ctx.author).manage_messages
+
     @commands.command(name='ask', help='Ask Gemini AI a question')
     async def ask_gemini(self, ctx, *, question: str):
         """
@@ -26,30 +418,130 @@ class GeminiChat(commands.Cog):
         Parameters:
             question (str): The question to ask Gemini AI
         """
-        await react_with_random_emoji(ctx.message)
+        react_with_random_emoji(ctx.message)
+        reply = PagedReply(ctx, self.model_name)
         try:
-            genai.configure(api_key=self.api_key)
-            model = genai.GenerativeModel(
-                model_name=self.model_name,
-                generation_config=self.generation_config,
-                system_instruction="You are a very smart AI, u intellectually explain whatever i ask or give me all the info i need. use concise short intuitive summaries, use less words if needed.You URL links and sources blogs and such, based on the query",
-            )
-            chat_session = model.start_chat(history=[])
-            response = chat_session.send_message(question)
-            
-            # Create and send response embed
-            embed = discord.Embed(
-                title="💭 Gemini AI Response",
-                description=response.text,
-                color=discord.Color.blue()
-            )
-            embed.set_footer(text=f"Model: {self.model_name}")
-            await ctx.send(embed=embed)
-            
+            key = self.session_key(ctx)
+            if not self.memory.is_enabled(key):
+                await self.answer(ctx, reply, question, [], self.cache_key(question))
+                return
+
+            conversation = self.memory.get(key)
+            # One turn at a time per conversation, so each question sees the answer before it
+            async with conversation.lock:
+                # Cached answers were given without any context, so they only fit a fresh conversation
+                cache_key = self.cache_key(question) if conversation.is_empty() else None
+                # The history sent is bounded by the memory's token budget, however long the conversation
+                history = conversation.history(self.memory.verbatim_budget)
+                answer = await self.answer(ctx, reply, question, history, cache_key)
+                overflow = self.memory.add(conversation, question, answer)
+            if overflow:
+                # In the background, so neither this command nor the channel's next question waits for the summarizer
+                task = conversation.compaction = asyncio.create_task(self.compact(conversation, overflow))
+                self.compactions.add(task)
+                task.add_done_callback(self.compactions.discard)
+
+        except asyncio.CancelledError:
+            # The command was edited or deleted; don't let a streamed edit send pages after its replies are cleaned up
+            reply.cancel()
+            raise
+
+        except AdmissionError as e:
+            # Refused after admission (too busy): don't make the user wait out a cooldown for nothing
+            self.upstream.refund(ctx.author.id, ctx.message.id)
+            await reply.fail(e.describe())
+
         except Exception as e:
-            await ctx.send(f"An error occurred: {str(e)}")
+            await reply.fail(f"An error occurred: {str(e)}")
             log_error(f"Error in ask_gemini: {str(e)}")
 
+    async def answer(self, ctx, reply, question, history, cache_key=None):
+        """Answer a question given the chat history before it, from the cache if cache_key has an answer; returns the answer"""
+        answer = self.response_cache.get(cache_key) if cache_key else None
+        if answer is None:
+            # Fail fast while Gemini is down or the user is on cooldown
+            self.upstream.admit(ctx.author.id, ctx.message.id)
+            if GEMINI_STREAM_RESPONSES:
+                # Show a placeholder right away and fill it in as chunks arrive
+                await reply.render("")
+            model = await self.get_model()
+            chat_session = model.start_chat(history=history)
+            async with self.upstream.slot(), metrics.track("gemini"):
+                if GEMINI_STREAM_RESPONSES:
+                    answer = ""
+                    last_chunk = None
+                    response = await chat_session.send_message_async(question, stream=True)
+                    async for chunk in response:
+                        last_chunk = chunk
+                        answer += chunk_text(chunk)
+                        reply.update(answer)
+                    check_finished(last_chunk, answer)
+                else:
+                    response = await chat_session.send_message_async(question)
+                    answer = response.text
+                    check_finished(response, answer)
+            if cache_key:
+                self.response_cache[cache_key] = answer
+
+        await reply.render(answer, final=True)
+        return answer
+
+    async def compact(self, conversation, overflow):
+        """Fold the oldest turns into the conversation's rolling summary, then drop them"""
+        transcript = "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in overflow)
+        prompt = (
+            "Update the summary of a conversation with the new exchanges below. Keep names, facts, "
+            f"decisions and open questions, in at most {GEMINI_SUMMARY_MAX_TOKENS * 3 // 4} words. "
+            "Reply with the summary only.\n\n"
+            f"Summary so far: {conversation.summary or '(none)'}\n\nNew exchanges:\n{transcript}"
+        )
+        try:
+            await self.get_model()
+            async with self.upstream.slot(), metrics.track("gemini"):
+                response = await self.summarizer.generate_content_async(prompt)
+            summary = response.text
+        except Exception as e:
+            log_error(f"Could not compact Gemini conversation: {str(e)}")
+            # Keep at least the gist of what was asked
+            summary = f"{conversation.summary} Earlier questions: " + "; ".join(question for question, _ in overflow)
+        finally:
+            conversation.compaction = None
+        # If it's too long, keep the end, where the newest questions are
+        conversation.summary = summary.strip()[-GEMINI_SUMMARY_MAX_TOKENS * 4:]
+        for turn in overflow:
+            if conversation.turns and conversation.turns[0] is turn:
+                conversation.turns.popleft()
+
+    @commands.command(name='memory', help='Shows or sets whether !ask remembers earlier questions in this channel (or for you). Usage: !memory [on|off]')
+    async def memory_setting(self, ctx, setting: str = None):
+        key = self.session_key(ctx)
+        where = "for you" if GEMINI_SESSION_SCOPE == "user" else "in this channel"
+        if setting is None:
+            state = "on" if self.memory.is_enabled(key) else "off"
+            await ctx.send(f"🧠 Conversation memory is {state} {where}. Use `!memory on` or `!memory off` to change it.")
+            return
+        if setting.lower() not in ("on", "off"):
+            raise commands.BadArgument("Use on or off")
+        if not self.may_change_memory(ctx):
+            await ctx.send("You need the Manage Messages permission to change memory in this channel.")
+            return
+        enabled = setting.lower() == "on"
+        self.memory.set_enabled(key, enabled)
+        if enabled:
+            await ctx.send(f"🧠 Conversation memory is on {where}: !ask will remember earlier questions.")
+        else:
+            await ctx.send(f"🧹 Conversation memory is off {where}: every !ask starts fresh.")
+
+    @commands.command(name='forget', help='Clears the conversation Gemini remembers for this channel (or you)')
+    async def forget_conversation(self, ctx):
+        if not self.may_change_memory(ctx):
+            await ctx.send("You need the Manage Messages permission to clear this channel's conversation.")
+            return
+        if self.memory.forget(self.session_key(ctx)):
+            await ctx.send("🧹 Conversation forgotten. The next !ask starts fresh.")
+        else:
+            await ctx.send("There's no conversation to forget.")
+
     @commands.command(name='gemini_info', help='Display information about the Gemini AI configuration')
     async def display_config(self, ctx):
         """Display the current configuration of the Gemini AI model"""
@@ -62,7 +554,21 @@ class GeminiChat(commands.Cog):
         embed.add_field(name="Top P", value=self.generation_config["top_p"], inline=True)
         embed.add_field(name="Top K", value=self.generation_config["top_k"], inline=True)
         embed.add_field(name="Max Tokens", value=self.generation_config["max_output_tokens"], inline=True)
+        embed.add_field(name="Conversations", value=f"{len(self.memory)}/{self.memory.max_conversations}", inline=True)
+        embed.add_field(name="Memory Budget", value=f"{self.memory.token_budget} tokens", inline=True)
+        embed.add_field(name="Memory", value=f"{'On' if self.memory.default_enabled else 'Off'} by default, "
+                        f"changed for {len(self.memory.settings)}", inline=True)
+
+        embed.add_field(name="Admission Control", value=self.upstream.describe(), inline=False)
+
+        cache = self.response_cache
+        embed.add_field(
+            name="Response Cache",
+            value=f"{len(cache)} entries, {cache.total_bytes / 1024:.1f} KiB\n"
+                  f"Hits: {cache.hits} | Misses: {cache.misses} | Hit rate: {cache.hit_rate():.0%}",
+            inline=False
+        )
         await ctx.send(embed=embed)
 
 async def setup(bot):
-    await bot.add_cog(GeminiChat(bot)) 
\ No newline at end of file
+    await bot.add_cog(GeminiChat(bot))
@@ -0,0 +1,172 @@
+import discord
+from discord.ext import commands
+import asyncio
+import os
+import glob
+import time
+import datetime
+from config import *
+from message_store import MessageStore, IMPORTED_GUILD
+from utils import log_error
+
+class History(commands.Cog):
+    """Cog for searching and summarizing the server's message history"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.store = MessageStore(HISTORY_DB)
+        self.pending = []
+        self.flush_task = None
+        self.import_task = None
+        # Set once export_state() has given the store to a reloaded instance
+        self.handed_off = False
+
+    async def cog_load(self):
+        """Open the store, start the batched writer and import the CSV log if that never ran"""
+        state = self.bot.cog_state.pop(self.qualified_name, None)
+        if state is not None:
+            self.import_state(state)
+        else:
+            await asyncio.to_thread(self.store.open)
+        self.flush_task = asyncio.create_task(self.flush_loop())
+        # The archive keeps appending while the import runs; anything newer than this is stored live
+        before_id = discord.utils.time_snowflake(discord.utils.utcnow())
+        self.import_task = asyncio.create_task(self.import_message_log(before_id))
+
+    async def cog_unload(self):
+        for task in (self.flush_task, self.import_task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(task for task in (self.flush_task, self.import_task) if task), return_exceptions=True)
+        if self.handed_off:
+            return
+        await self.flush()
+        await asyncio.to_thread(self.store.close)
+
+    def export_state(self):
+        """Hand the open store and unwritten messages to the instance replacing this one on reload"""
+        self.handed_off = True
+        return {"store": self.store, "pending": self.pending}
+
+    def import_state(self, state):
+        self.store = state["store"]
+        self.pending = state["pending"]
+
+    async def import_message_log(self, before_id):
+        # The shared log from before any cluster split; cluster workers' own logs are ingested live.
+        # Rotated segments first, so rows come in roughly oldest first
+        paths = sorted(glob.glob(f"{glob.escape(MESSAGE_LOG)}.*")) + [MESSAGE_LOG]
+        paths = [path for path in paths if os.path.exists(path)]
+        try:
+            imported = await asyncio.to_thread(self.store.import_csv, paths, before_id)
+        except Exception as e:
+            log_error(f"Could not import {MESSAGE_LOG} into the message store: {str(e)}")
+            return
+        if imported:
+            print(f"Imported {imported} messages from {MESSAGE_LOG} into {HISTORY_DB}")
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.author == self.bot.user or message.guild is None:
+            return
+        self.pending.append((
+            message.id,
+            message.guild.id,
+            message.channel.id,
+            message.author.id,
+            message.author.name,
+            message.content,
+            time.time(),
+        ))
+        if len(self.pending) >= HISTORY_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        """Write buffered messages in one transaction, off the event loop"""
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self.store.add, rows)
+        except Exception as e:
+            log_error(f"Could not write {len(rows)} messages to the message store: {str(e)}")
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+            await self.flush()
+
+    def channel_name(self, channel_id):
+        if channel_id is None:
+            return "imported log"
+        channel = self.bot.get_channel(channel_id)
+        return f"#{channel.name}" if channel else f"#{channel_id}"
+
+    @staticmethod
+    def format_time(timestamp):
+        if timestamp is None:
+            return "unknown"
+        return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+    @commands.command(name='search', help='Searches the message history. Usage: !search <terms>')
+    @commands.guild_only()
+    async def search_history(self, ctx, *, terms: str):
+        # Make what was just said searchable too
+        await self.flush()
+        await ctx.send(embed=await self.search_embed(ctx.guild.id, terms))
+
+    # Imported rows can't be tied to a server and include DMs, so only the owner (who has the CSV anyway) sees them, in a DM
+    @commands.command(name='search_log', help='Searches messages imported from the old CSV log, answered by DM (bot owner only). Usage: !search_log <terms>')
+    @commands.is_owner()
+    async def search_imported(self, ctx, *, terms: str):
+        await ctx.author.send(embed=await self.search_embed(IMPORTED_GUILD, terms))
+
+    async def search_embed(self, guild_id, terms):
+        start = time.perf_counter()
+        results = await asyncio.to_thread(self.store.search, guild_id, terms, HISTORY_SEARCH_LIMIT)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        embed = discord.Embed(title=f"🔎 Search: {terms[:200]}", color=discord.Color.blue())
+        for author_name, channel_id, content, created_at in results:
+            snippet = content if len(content) <= 200 else content[:197] + "..."
+            embed.add_field(
+                name=f"{author_name} in {self.channel_name(channel_id)} · {self.format_time(created_at)}",
+                value=snippet or "(no text)",
+                inline=False,
+            )
+        if not results:
+            embed.description = "No messages found."
+        embed.set_footer(text=f"{len(results)} results in {elapsed:.0f}ms")
+        return embed
+
+    @commands.command(name='stats', help='Shows message statistics for the server or a user. Usage: !stats [user]')
+    @commands.guild_only()
+    async def message_stats(self, ctx, member: discord.Member = None):
+        await self.flush()
+        start = time.perf_counter()
+        since = time.time() - 7 * 24 * 3600
+
+        if member is not None:
+            stats = await asyncio.to_thread(self.store.user_stats, ctx.guild.id, member.id, since)
+            embed = discord.Embed(title=f"📊 Messages from {member.display_name}", color=discord.Color.green())
+            embed.add_field(name="Total", value=f"{stats['total']:,}", inline=True)
+            embed.add_field(name="Last 7 Days", value=f"{stats['recent']:,}", inline=True)
+            embed.add_field(name="First Seen", value=self.format_time(stats['first']), inline=True)
+            embed.add_field(name="Last Seen", value=self.format_time(stats['last']), inline=True)
+        else:
+            stats = await asyncio.to_thread(self.store.guild_stats, ctx.guild.id, since)
+            embed = discord.Embed(title=f"📊 Messages in {ctx.guild.name}", color=discord.Color.green())
+            embed.add_field(name="Total", value=f"{stats['total']:,}", inline=True)
+            embed.add_field(name="Last 7 Days", value=f"{stats['recent']:,}", inline=True)
+            if stats['authors']:
+                lines = [f"{name}: {count:,}" for name, count in stats['authors']]
+                embed.add_field(name="Top Authors", value="\n".join(lines), inline=False)
+
+        if stats['channels']:
+            lines = [f"{self.channel_name(channel_id)}: {count:,}" for channel_id, count in stats['channels']]
+            embed.add_field(name="Busiest Channels", value="\n".join(lines), inline=False)
+        embed.set_footer(text=f"Answered in {(time.perf_counter() - start) * 1000:.0f}ms")
+        await ctx.send(embed=embed)
+
+async def setup(bot):
+    await bot.add_cog(History(bot))
@@ -1,12 +1,55 @@
 import discord
 from discord.ext import commands
-import requests
+import aiohttp
+import asyncio
 import os
 import base64
+import json
 import io
 from config import *
+from admission import admission, AdmissionError
+from batcher import MicroBatcher
+from image_cache import ImageCache
+from metrics import metrics
+from scheduler import JobScheduler, QueueFullError
 from utils import react_with_random_emoji, log_error
 
+def archive_images(images, message_id):
+    """Keep a copy of generated images on disk (opt-in via RETRO_ARCHIVE_IMAGES)"""
+    os.makedirs(GENERATED_IMAGES_DIR, exist_ok=True)
+    for i, img_data in enumerate(images):
+        with open(os.path.join(GENERATED_IMAGES_DIR, f"retro_{message_id}_{i}.png"), 'wb') as file:
+            file.write(img_data)
+
+class RetroAPIError(Exception):
+    """Raised when the RetroAI API answers with an HTTP error status"""
+
+    def __init__(self, status, reason, body):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.body = body
+
+    def describe(self):
+        """User-facing error message, including validation details when the API sent them"""
+        error_msg = "❌ HTTP error occurred"
+        try:
+            error_details = json.loads(self.body)
+            if 'detail' in error_details:
+                if isinstance(error_details['detail'], list):
+                    # Handle validation errors
+                    errors = [f"{e['msg']} ({'.'.join(map(str, e['loc']))})" for e in error_details['detail']]
+                    return f"{error_msg}: {'; '.join(errors)}"
+                return f"{error_msg}: {error_details['detail']}"
+        except Exception:
+            pass
+        return f"{error_msg}: {str(self)}"
+
+def is_upstream_failure(error):
+    """Rejected input (4xx other than 429) is our fault, not a sign the API is unhealthy"""
+    if isinstance(error, RetroAPIError):
+        return error.status >= 500 or error.status == 429
+    return True
+
 class RetroDiffusion(commands.Cog):
     """Cog for generating retro-style images using RetroAI Diffusion"""
     
@@ -17,6 +60,181 @@ class RetroDiffusion(commands.Cog):
         if not self.api_key:
             log_error("RetroAI API key not found in environment variables")
             print("RetroAI API key not found. Please check your .env file.")
+        self.session = None
+        # The adaptive limit decides how many queued jobs run, so jobs never wait again for a slot
+        self.scheduler = JobScheduler(
+            concurrency=RETRO_MAX_CONCURRENCY,
+            max_queue=RETRO_MAX_QUEUE,
+            limit=lambda: self.upstream.limiter.limit,
+        )
+        self.batcher = None
+        if RETRO_BATCH_ENABLED:
+            self.batcher = MicroBatcher(
+                window=RETRO_BATCH_WINDOW,
+                max_wait=RETRO_BATCH_MAX_WAIT,
+                max_size=RETRO_BATCH_MAX_IMAGES,
+                on_flush=self.submit_batch,
+            )
+        self.image_cache = ImageCache(RETRO_CACHE_DIR, RETRO_CACHE_MAX_BYTES) if RETRO_CACHE_ENABLED else None
+        # Set once export_state() has given the session and queues to a reloaded instance
+        self.handed_off = False
+        self.upstream = admission.upstream(
+            "retrodiffusion",
+            label="RetroAI",
+            max_concurrency=RETRO_MAX_CONCURRENCY,
+            target_latency=RETRO_TARGET_LATENCY,
+            cooldown=RETRO_COOLDOWN,
+            max_waiting=ADMISSION_MAX_WAITING,
+            wait_timeout=ADMISSION_WAIT_TIMEOUT,
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=BREAKER_RESET_TIMEOUT,
+            is_failure=is_upstream_failure,
+        )
+
+    async def cog_load(self):
+        """Open the shared HTTP session used for all RetroAI requests"""
+        state = self.bot.cog_state.pop(self.qualified_name, None)
+        if state is not None:
+            self.import_state(state)
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=RETRO_HTTP_POOL_SIZE,
+            limit_per_host=RETRO_HTTP_POOL_SIZE,
+            keepalive_timeout=RETRO_HTTP_KEEPALIVE,
+        )
+        timeout = aiohttp.ClientTimeout(total=RETRO_HTTP_TIMEOUT, connect=RETRO_HTTP_CONNECT_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+        if self.image_cache is not None:
+            try:
+                await asyncio.to_thread(self.image_cache.load)
+            except Exception as e:
+                log_error(f"Could not load RetroAI image cache index: {str(e)}")
+
+    async def cog_unload(self):
+        """Stop queued jobs and close the shared HTTP session and its pooled connections"""
+        if self.handed_off:
+            return
+        if self.batcher is not None:
+            self.batcher.close()
+        await self.scheduler.close()
+        if self.image_cache is not None:
+            try:
+                await asyncio.to_thread(self.image_cache.save)
+            except Exception as e:
+                log_error(f"Could not save RetroAI image cache index: {str(e)}")
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    def export_state(self):
+        """Hand the live session, queue, batcher and cache to the instance replacing this one on reload"""
+        self.handed_off = True
+        return {"session": self.session, "scheduler": self.scheduler, "batcher": self.batcher, "image_cache": self.image_cache}
+
+    def import_state(self, state):
+        self.session = state["session"]
+        self.scheduler = state["scheduler"]
+        self.image_cache = state["image_cache"]
+        if state["batcher"] is not None and self.batcher is not None:
+            self.batcher = state["batcher"]
+            # Batches still open should be submitted through the new code
+            self.batcher.on_flush = self.submit_batch
+
+    async def request_images(self, payload):
+        """Send one generation request to RetroAI and return the parsed JSON response"""
+        headers = {
+            "X-RD-Token": str(self.api_key).strip(),
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+
+        # Log the request details (excluding API key)
+        log_headers = headers.copy()
+        log_headers["X-RD-Token"] = "REDACTED"
+        log_error(f"RetroAI Request - URL: {self.api_url}, Headers: {log_headers}, Payload: {payload}")
+
+        async with self.upstream.slot(acquire=False), metrics.track("retrodiffusion"):
+            async with self.session.post(self.api_url, headers=headers, json=payload) as response:
+                response_text = await response.text()
+                if response.status >= 400:
+                    raise RetroAPIError(response.status, response.reason, response_text)
+                return json.loads(response_text)
+
+    async def cache_images(self, key, images, metadata):
+        """Store generated images in the image cache, if it's enabled"""
+        if self.image_cache is not None:
+            try:
+                await asyncio.to_thread(self.image_cache.put, key, images, metadata)
+            except Exception as e:
+                log_error(f"Error caching generated images: {str(e)}")
+
+    async def generate(self, payload, key=None):
+        """Run one generation and decode its images into memory, caching them under key if given"""
+        result = await self.request_images(payload)
+        # Batches can be bigger than the 10 attachments Discord allows per message, so keep them all here
+        images = [base64.b64decode(data) for data in result.get("base64_images", [])]
+        metadata = {
+            "model": result.get("model", payload["model"]),
+            "credit_cost": result.get("credit_cost", "1"),
+        }
+        if images and key is not None:
+            await self.cache_images(key, images[:10], metadata)
+        return {"images": images, **metadata, "remaining_credits": result.get("remaining_credits", "N/A"), "cached": False}
+
+    async def send_result(self, ctx, prompt, result):
+        """Send generated images from memory, with an embed describing the generation"""
+        images = result["images"]
+        if RETRO_ARCHIVE_IMAGES:
+            try:
+                await asyncio.to_thread(archive_images, images, ctx.message.id)
+            except Exception as e:
+                log_error(f"Error archiving generated images: {str(e)}")
+
+        # Send info about the generation
+        embed = discord.Embed(
+            title="🎨 RetroAI Image Generation",
+            description=f"**Prompt:** {prompt}",
+            color=discord.Color.purple()
+        )
+        embed.add_field(name="Model", value=result["model"], inline=True)
+        if result["cached"]:
+            embed.add_field(name="Credit Cost", value="0 (cached)", inline=True)
+        else:
+            embed.add_field(name="Credit Cost", value=result["credit_cost"], inline=True)
+            embed.add_field(name="Remaining Credits", value=result["remaining_credits"], inline=True)
+
+        # Discord allows 10 attachments per message
+        files = [
+            discord.File(io.BytesIO(img_data), filename=f"retro_{ctx.message.id}_{i}.png")
+            for i, img_data in enumerate(images[:10])
+        ]
+        await ctx.send(embed=embed, files=files)
+
+    def submit_batch(self, batch):
+        """Queue a closed micro-batch as one multi-image generation job"""
+        payload = json.loads(batch.key)
+        payload["num_images"] = batch.total
+        guild_id, user_id = batch.owner
+        key = f"batch:{batch.key}:{batch.opened}"
+        # Every request in the batch waits on this one job
+        return self.scheduler.submit(key, guild_id, user_id, lambda: self.generate(payload), waiters=len(batch.sizes))
+
+    async def wait_for_job(self, job, status_message, prompt):
+        """Wait for a scheduled job, keeping the status message's queue position up to date"""
+        last_position = None
+        while not job.done():
+            position = self.scheduler.position(job)
+            if position != last_position:
+                if position:
+                    content = f"🎨 Queued retro-style image for prompt: {prompt} (position {position} in queue)..."
+                else:
+                    content = f"🎨 Generating retro-style image for prompt: {prompt}..."
+                if last_position is not None:
+                    await status_message.edit(content=content)
+                last_position = position
+            await asyncio.wait({job.future}, timeout=RETRO_QUEUE_POLL_INTERVAL)
+        return await self.scheduler.wait(job)
 
     @commands.command(name='retro', help="Generates a retro-style image from text prompt")
     async def generate_retro(self, ctx, *, prompt: str):
@@ -29,103 +247,95 @@ class RetroDiffusion(commands.Cog):
             await ctx.send("⚠️ RetroAI API key not configured. Please set the RETRO_API_KEY environment variable.")
             return
 
-        await react_with_random_emoji(ctx.message)
-        status_message = await ctx.send(f"🎨 Generating retro-style image for prompt: {prompt}...")
-        
+        react_with_random_emoji(ctx.message)
+
+        payload = {
+            "model": "RD_FLUX",
+            "width": 512,
+            "height": 512,
+            "prompt": prompt,
+            "num_images": RETRO_NUM_IMAGES
+        }
+
+        # Same payload as an earlier generation: answer from the cache, no credits spent
+        key = ImageCache.key_for(payload)
+        if self.image_cache is not None:
+            cached = await asyncio.to_thread(self.image_cache.get, key)
+            if cached is not None:
+                images, metadata = cached
+                await self.send_result(ctx, prompt, {"images": images, **metadata, "cached": True})
+                return
+
+        # Fail fast while RetroAI is down or the user is on cooldown, instead of queueing
         try:
-            headers = {
-                "X-RD-Token": str(self.api_key).strip(),
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            }
-
-            payload = {
-                "model": "RD_FLUX",
-                "width": 512,
-                "height": 512,
-                "prompt": prompt,
-                "num_images": 1
-            }
-
-            async with ctx.typing():
-                response = requests.post(
-                    self.api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=30  # Add timeout
-                )
-                
-                # Log the request details (excluding API key)
-                log_headers = headers.copy()
-                log_headers["X-RD-Token"] = "REDACTED"
-                log_error(f"RetroAI Request - URL: {self.api_url}, Headers: {log_headers}, Payload: {payload}")
-                
-                response.raise_for_status()
-            
-            # Process the response
-            result = response.json()
-            if "base64_images" in result and len(result["base64_images"]) > 0:
-                # Decode the base64 image
-                img_data = base64.b64decode(result["base64_images"][0])
-                
-                # Ensure the directory exists
-                os.makedirs(GENERATED_IMAGES_DIR, exist_ok=True)
-                
-                # Save the image temporarily
-                image_path = os.path.join(GENERATED_IMAGES_DIR, f"retro_{ctx.message.id}.png")
-                with open(image_path, 'wb') as file:
-                    file.write(img_data)
-                
-                # Send info about the generation
-                embed = discord.Embed(
-                    title="🎨 RetroAI Image Generation",
-                    description=f"**Prompt:** {prompt}",
-                    color=discord.Color.purple()
-                )
-                embed.add_field(name="Model", value=result.get("model", "RD_FLUX"), inline=True)
-                embed.add_field(name="Credit Cost", value=result.get("credit_cost", "1"), inline=True)
-                embed.add_field(name="Remaining Credits", value=result.get("remaining_credits", "N/A"), inline=True)
-                
-                # Delete the status message and send the result
-                await status_message.delete()
-                await ctx.send(embed=embed, file=discord.File(image_path))
-                
-                # Clean up the temporary file
-                try:
-                    os.remove(image_path)
-                except Exception as e:
-                    log_error(f"Error cleaning up temporary file: {str(e)}")
+            self.upstream.admit(ctx.author.id, ctx.message.id)
+        except AdmissionError as e:
+            await ctx.send(e.describe())
+            return
+
+        guild_id = ctx.guild.id if ctx.guild else None
+        try:
+            if self.batcher is not None:
+                # Requests for the same prompt arriving together become one multi-image call
+                batch_key = json.dumps({k: v for k, v in payload.items() if k != "num_images"}, sort_keys=True)
+                job, start, stop = await self.batcher.join(batch_key, payload["num_images"], owner=(guild_id, ctx.author.id))
             else:
-                await status_message.edit(content="❌ No images were generated in the response.")
-            
-        except requests.exceptions.HTTPError as http_err:
-            error_msg = "❌ HTTP error occurred"
+                # Identical requests already queued or running share one upstream call
+                job = self.scheduler.submit(key, guild_id, ctx.author.id, lambda: self.generate(payload, key))
+                start, stop = 0, None
+        except QueueFullError:
+            self.upstream.refund(ctx.author.id, ctx.message.id)
+            await ctx.send("⏳ The image queue is full right now. Please try again in a little while.")
+            return
+
+        try:
+            position = self.scheduler.position(job)
+            if position:
+                status_message = await ctx.send(f"🎨 Queued retro-style image for prompt: {prompt} (position {position} in queue)...")
+            else:
+                status_message = await ctx.send(f"🎨 Generating retro-style image for prompt: {prompt}...")
+        
             try:
-                error_details = response.json()
-                if 'detail' in error_details:
-                    if isinstance(error_details['detail'], list):
-                        # Handle validation errors
-                        errors = [f"{e['msg']} ({'.'.join(map(str, e['loc']))})" for e in error_details['detail']]
-                        error_msg = f"{error_msg}: {'; '.join(errors)}"
-                    else:
-                        error_msg = f"{error_msg}: {error_details['detail']}"
-            except Exception:
-                error_msg = f"{error_msg}: {str(http_err)}"
+                async with ctx.typing():
+                    result = await self.wait_for_job(job, status_message, prompt)
+
+                if stop is not None:
+                    # Take this request's share of the batch; the first share is cached for repeats
+                    result = {**result, "images": result["images"][start:stop]}
+                    if start == 0 and result["images"]:
+                        await self.cache_images(key, result["images"], {"model": result["model"], "credit_cost": result["credit_cost"]})
+            
+                if result["images"]:
+                    # Delete the status message and send the result
+                    await status_message.delete()
+                    await self.send_result(ctx, prompt, result)
+                else:
+                    await status_message.edit(content="❌ No images were generated in the response.")
             
-            await status_message.edit(content=error_msg)
-            log_error(f"RetroAI HTTP error: {str(http_err)}. Response: {response.text}")
+            except AdmissionError as e:
+                # Refused after admission (too busy): don't make the user wait out a cooldown for nothing
+                self.upstream.refund(ctx.author.id, ctx.message.id)
+                await status_message.edit(content=e.describe())
             
-        except requests.exceptions.Timeout:
-            await status_message.edit(content="❌ Request timed out. Please try again.")
-            log_error("RetroAI request timed out")
+            except RetroAPIError as http_err:
+                await status_message.edit(content=http_err.describe())
+                log_error(f"RetroAI HTTP error: {str(http_err)}. Response: {http_err.body}")
             
-        except requests.exceptions.RequestException as e:
-            await status_message.edit(content=f"❌ Network error occurred: {str(e)}")
-            log_error(f"RetroAI request error: {str(e)}")
+            except asyncio.TimeoutError:
+                await status_message.edit(content="❌ Request timed out. Please try again.")
+                log_error("RetroAI request timed out")
             
-        except Exception as e:
-            await status_message.edit(content=f"❌ An unexpected error occurred: {str(e)}")
-            log_error(f"RetroAI unexpected error: {str(e)}")
+            except aiohttp.ClientError as e:
+                await status_message.edit(content=f"❌ Network error occurred: {str(e)}")
+                log_error(f"RetroAI request error: {str(e)}")
+            
+            except Exception as e:
+                await status_message.edit(content=f"❌ An unexpected error occurred: {str(e)}")
+                log_error(f"RetroAI unexpected error: {str(e)}")
+
+        finally:
+            # Once no request is waiting (e.g. this one was superseded by an edit), the generation is dropped or cancelled
+            self.scheduler.release(job)
 
     @commands.command(name='retro_models', help="Lists available RetroAI models")
     async def list_models(self, ctx):
@@ -164,6 +374,20 @@ class RetroDiffusion(commands.Cog):
         embed.add_field(name="API Key Status", value=key_status, inline=True)
         embed.add_field(name="API Key Preview", value=visible_key, inline=True)
         embed.add_field(name="API URL", value=self.api_url, inline=False)
+        embed.add_field(
+            name="Queue",
+            value=f"Running: {self.scheduler.running}/{self.scheduler.capacity} (max {self.scheduler.concurrency}) | "
+                  f"Queued: {self.scheduler.queued}/{self.scheduler.max_queue}\n"
+                  f"Merged: {self.scheduler.merged} | Rejected: {self.scheduler.rejected} | Completed: {self.scheduler.completed}",
+            inline=False
+        )
+        embed.add_field(name="Admission Control", value=self.upstream.describe(), inline=False)
+        if self.batcher is not None:
+            embed.add_field(
+                name="Micro-batching",
+                value=f"{self.batcher.requests} requests in {self.batcher.batches} upstream calls",
+                inline=False
+            )
         
         # Add environment check
         env_key = os.getenv('RETRODIFF_API')
@@ -177,5 +401,26 @@ class RetroDiffusion(commands.Cog):
         
         await ctx.send(embed=embed)
 
+    @commands.command(name='retro_cache', help="Show RetroAI image cache statistics (Admin only)")
+    @commands.has_permissions(administrator=True)
+    async def cache_stats(self, ctx):
+        """Show hit rate and disk usage of the generated-image cache (Admin only)"""
+        if self.image_cache is None:
+            await ctx.send("The RetroAI image cache is disabled.")
+            return
+
+        cache = self.image_cache
+        embed = discord.Embed(
+            title="🗄️ RetroAI Image Cache",
+            color=discord.Color.orange()
+        )
+        embed.add_field(name="Entries", value=len(cache), inline=True)
+        embed.add_field(name="Size", value=f"{cache.total_bytes / (1024 * 1024):.1f} / {cache.max_bytes / (1024 * 1024):.0f} MiB", inline=True)
+        embed.add_field(name="Hit Rate", value=f"{cache.hit_rate():.0%}", inline=True)
+        embed.add_field(name="Hits", value=cache.hits, inline=True)
+        embed.add_field(name="Misses", value=cache.misses, inline=True)
+        embed.add_field(name="Location", value=cache.directory, inline=False)
+        await ctx.send(embed=embed)
+
 async def setup(bot):
     await bot.add_cog(RetroDiffusion(bot)) 
\ No newline at end of file
@@ -1,25 +1,132 @@
 import discord
 from discord.ext import commands
 import platform
-import psutil
 import datetime
+import re
 from config import *
+from cache import TTLCache
+from metrics import metrics
+from role_index import RoleIndex
+from sysstats import system_stats, cache_sizes
 from utils import react_with_random_emoji, log_error
 
+# !info trend windows: label -> seconds
+STATS_WINDOWS = (("1m", 60), ("5m", 5 * 60), ("15m", 15 * 60))
+
+class FetchedMember(commands.MemberConverter):
+    """Member converter that falls back to a cached REST fetch when the member cache can't help (lean gateway mode)"""
+
+    async def convert(self, ctx, argument):
+        try:
+            return await super().convert(ctx, argument)
+        except (commands.MemberNotFound, discord.ClientException):
+            match = self._get_id_match(argument) or re.match(r'<@!?([0-9]{15,20})>$', argument)
+            member = None
+            if match is not None and ctx.guild is not None:
+                member = await ctx.cog.fetch_member(ctx.guild, int(match.group(1)))
+            if member is None:
+                raise commands.MemberNotFound(argument)
+            return member
+
 class Utility(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.role_index = RoleIndex()
+        # Members and guild counts fetched over REST when the gateway caches don't have them
+        self.fetched = TTLCache(maxsize=FETCH_CACHE_SIZE, ttl=FETCH_CACHE_TTL)
+
+    async def cog_load(self):
+        state = self.bot.cog_state.pop(self.qualified_name, None)
+        if state is not None:
+            self.import_state(state)
+
+    def export_state(self):
+        """Hand the role index and fetched members to the instance replacing this one on reload"""
+        return {"role_index": self.role_index, "fetched": self.fetched}
+
+    def import_state(self, state):
+        self.role_index = state["role_index"]
+        self.fetched = state["fetched"]
+
+    async def fetch_member(self, guild, user_id):
+        """A guild member from the cache, or fetched (and kept for a while) if it isn't there"""
+        member = guild.get_member(user_id) or self.fetched.get(("member", guild.id, user_id))
+        if member is None:
+            try:
+                member = await guild.fetch_member(user_id)
+            except (discord.NotFound, discord.Forbidden):
+                return None
+            self.fetched[("member", guild.id, user_id)] = member
+        return member
+
+    async def member_count(self, guild):
+        if guild.member_count is not None:
+            return guild.member_count
+        count = self.fetched.get(("member_count", guild.id))
+        if count is None:
+            fetched = await self.bot.fetch_guild(guild.id, with_counts=True)
+            count = self.fetched[("member_count", guild.id)] = fetched.approximate_member_count
+        return count
+
+    def role_counts(self, guild):
+        """Role member counts, or None in lean gateway mode, where there's no member cache to count from"""
+        if LEAN_GATEWAY:
+            return None
+        return self.role_index.counts(guild)
+
+    # Keep the role index current instead of rescanning members on every !roles (these only arrive with MEMBERS_INTENT)
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        self.role_index.member_joined(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.role_index.member_left(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        self.role_index.member_updated(before, after)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self.role_index.role_deleted(role)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.role_index.forget(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild):
+        # Fires again after a reconnect that couldn't resume, when member
+        # events may have been missed; rebuild from the fresh cache
+        self.role_index.forget(guild)
+
+    def shard_status(self, shard_id):
+        """One-line health summary for a shard of an AutoShardedBot"""
+        shard = self.bot.get_shard(shard_id)
+        if shard is None:
+            return "not in this process"
+        if shard.is_closed():
+            status = "disconnected"
+        elif shard.is_ws_ratelimited():
+            status = "rate limited"
+        else:
+            status = "connected"
+        latency = f"{shard.latency * 1000:.0f}ms" if shard.latency == shard.latency else "n/a"  # NaN before the first heartbeat
+        return f"{status}, {latency}"
 
     @commands.command(name='serverinfo', help='Displays information about the server')
     async def server_info(self, ctx):
         guild = ctx.guild
         embed = discord.Embed(title=f"{guild.name} Server Information", color=discord.Color.blue())
         embed.add_field(name="Server ID", value=guild.id, inline=True)
-        embed.add_field(name="Member Count", value=guild.member_count, inline=True)
-        embed.add_field(name="Owner", value=guild.owner, inline=True)
+        embed.add_field(name="Member Count", value=await self.member_count(guild), inline=True)
+        embed.add_field(name="Owner", value=guild.owner or await self.fetch_member(guild, guild.owner_id), inline=True)
         embed.add_field(name="Created On", value=guild.created_at.strftime("%Y-%m-%d"), inline=True)
         embed.add_field(name="Roles", value=len(guild.roles), inline=True)
         embed.add_field(name="Channels", value=len(guild.channels), inline=True)
+        if isinstance(self.bot, commands.AutoShardedBot):
+            embed.add_field(name="Shard", value=f"{guild.shard_id} ({self.shard_status(guild.shard_id)})", inline=True)
         
         if guild.icon:
             embed.set_thumbnail(url=guild.icon.url)
@@ -27,9 +134,14 @@ class Utility(commands.Cog):
         await ctx.send(embed=embed)
 
     @commands.command(name='userinfo', help='Displays information about a user')
-    async def user_info(self, ctx, member: discord.Member = None):
+    async def user_info(self, ctx, member: FetchedMember = None):
         member = member or ctx.author
-        roles = [role.name for role in member.roles if role.name != "@everyone"]
+        roles = [role for role in reversed(member.roles) if not role.is_default()]
+        counts = self.role_counts(ctx.guild)
+        role_lines = [f"{role.name} ({counts[role.id]})" if counts is not None else role.name
+                      for role in roles[:USERINFO_MAX_ROLES]]
+        if len(roles) > USERINFO_MAX_ROLES:
+            role_lines.append(f"and {len(roles) - USERINFO_MAX_ROLES} more")
         
         embed = discord.Embed(title=f"{member.name}'s Information", color=discord.Color.green())
         embed.add_field(name="User ID", value=member.id, inline=True)
@@ -37,7 +149,7 @@ class Utility(commands.Cog):
         embed.add_field(name="Status", value=str(member.status).title(), inline=True)
         embed.add_field(name="Joined Server", value=member.joined_at.strftime("%Y-%m-%d"), inline=True)
         embed.add_field(name="Account Created", value=member.created_at.strftime("%Y-%m-%d"), inline=True)
-        embed.add_field(name="Roles", value=", ".join(roles) if roles else "None", inline=False)
+        embed.add_field(name=f"Roles ({len(roles)})", value=", ".join(role_lines)[:1024] if roles else "None", inline=False)
         
         if member.avatar:
             embed.set_thumbnail(url=member.avatar.url)
@@ -52,14 +164,61 @@ class Utility(commands.Cog):
         embed.add_field(name="Bot ID", value=self.bot.user.id, inline=True)
         embed.add_field(name="Servers", value=len(self.bot.guilds), inline=True)
         embed.add_field(name="Commands", value=len(self.bot.commands), inline=True)
+
+        # Shards run by this process (only when sharding is on)
+        if isinstance(self.bot, commands.AutoShardedBot):
+            guild_counts = {}
+            for guild in self.bot.guilds:
+                guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+            lines = [
+                f"`{shard_id}`: {self.shard_status(shard_id)}, {guild_counts.get(shard_id, 0)} servers"
+                for shard_id in sorted(self.bot.shards)
+            ]
+            title = f"Shards ({len(lines)} of {self.bot.shard_count})"
+            if CLUSTER_ID is not None:
+                title += f", cluster {CLUSTER_ID}"
+            embed.add_field(name=title, value="\n".join(lines[:20]) or "None yet", inline=False)
         
         # System stats
         embed.add_field(name="Python Version", value=platform.python_version(), inline=True)
         embed.add_field(name="Discord.py Version", value=discord.__version__, inline=True)
         
-        # Resource usage
-        embed.add_field(name="CPU Usage", value=f"{psutil.cpu_percent()}%", inline=True)
-        embed.add_field(name="Memory Usage", value=f"{psutil.virtual_memory().percent}%", inline=True)
+        # Resource usage trends from the background sampler, as average / peak per window
+        trends = (
+            ("Memory (RSS)", "rss_bytes", lambda value: f"{value / (1024 * 1024):.0f} MiB"),
+            ("CPU (process)", "cpu_percent", lambda value: f"{value:.0f}%"),
+            ("Event Loop Lag", "loop_lag", lambda value: f"{value * 1000:.1f}ms"),
+            ("Cached Members", "members", lambda value: f"{value:,.0f}"),
+        )
+        for name, field, fmt in trends:
+            lines = []
+            for label, seconds in STATS_WINDOWS:
+                summary = system_stats.summary(field, seconds)
+                if summary is not None:
+                    lines.append(f"{label}: {fmt(summary[0])} / {fmt(summary[1])}")
+            if lines:
+                embed.add_field(name=f"{name} avg / peak", value="\n".join(lines), inline=True)
+        
+        # Performance
+        gateway_series = metrics.series("gateway_latency_seconds")
+        if gateway_series:
+            embed.add_field(name="Gateway Latency (avg)", value=f"{gateway_series[0][1].mean() * 1000:.0f}ms", inline=True)
+
+        command_series = sorted(metrics.series("command_latency_seconds"), key=lambda item: item[1].count, reverse=True)
+        if command_series:
+            lines = [
+                f"`{labels['command']}` ×{hist.count}: p50 {hist.quantile(0.5) * 1000:.0f}ms, p99 {hist.quantile(0.99) * 1000:.0f}ms"
+                for labels, hist in command_series[:5]
+            ]
+            embed.add_field(name="Command Latency", value="\n".join(lines), inline=False)
+
+        upstream_series = metrics.series("upstream_latency_seconds")
+        if upstream_series:
+            lines = []
+            for labels, hist in upstream_series:
+                errors = metrics.get_counter("upstream_requests_total", upstream=labels["upstream"], status="error")
+                lines.append(f"`{labels['upstream']}` ×{hist.count}: p50 {hist.quantile(0.5):.2f}s, p99 {hist.quantile(0.99):.2f}s, {errors} errors")
+            embed.add_field(name="Upstream APIs", value="\n".join(lines), inline=False)
         
         # Uptime (if you track when the bot started)
         if hasattr(self.bot, 'start_time'):
@@ -73,7 +232,7 @@ class Utility(commands.Cog):
 
     @commands.command(name='ping', help="Checks the bot's latency")
     async def check_ping(self, ctx):
-        await react_with_random_emoji(ctx.message)
+        react_with_random_emoji(ctx.message)
         start_time = datetime.datetime.now()
         message = await ctx.send("Pinging...")
         end_time = datetime.datetime.now()
@@ -87,10 +246,16 @@ class Utility(commands.Cog):
         
         await message.edit(content=None, embed=embed)
 
-    @commands.command(name='roles', help='Lists all roles in the server')
-    async def list_roles(self, ctx):
-        roles = sorted(ctx.guild.roles, key=lambda x: x.position, reverse=True)
-        role_list = [f"{role.mention} - {len(role.members)} members" for role in roles if role.name != "@everyone"]
+    @commands.command(name='roles', help='Lists all roles in the server. Usage: !roles [page]')
+    async def list_roles(self, ctx, page: int = 1):
+        # guild.roles is already sorted by position, lowest first
+        roles = [role for role in reversed(ctx.guild.roles) if not role.is_default()]
+        pages = max(1, -(-len(roles) // ROLES_PAGE_SIZE))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * ROLES_PAGE_SIZE
+        counts = self.role_counts(ctx.guild)
+        role_list = [f"{role.mention} - {counts[role.id]} members" if counts is not None else role.mention
+                     for role in roles[start:start + ROLES_PAGE_SIZE]]
         
         embed = discord.Embed(title=f"Roles in {ctx.guild.name}", color=discord.Color.blue())
         
@@ -98,14 +263,48 @@ class Utility(commands.Cog):
         chunks = [role_list[i:i + 10] for i in range(0, len(role_list), 10)]
         
         for i, chunk in enumerate(chunks):
-            embed.add_field(name=f"Roles {i*10+1}-{i*10+len(chunk)}", value="\n".join(chunk), inline=False)
+            embed.add_field(name=f"Roles {start+i*10+1}-{start+i*10+len(chunk)}", value="\n".join(chunk), inline=False)
+        footer = []
+        if pages > 1:
+            footer.append(f"Page {page}/{pages} · {len(roles)} roles · {BOT_PREFIX}roles <page> for more")
+        if counts is None:
+            footer.append("No member counts in lean gateway mode (it keeps no member cache)")
+        elif not self.bot.intents.members:
+            footer.append("Member counts only cover cached members (set MEMBERS_INTENT for full counts)")
+        if footer:
+            embed.set_footer(text="\n".join(footer))
             
         await ctx.send(embed=embed)
 
+    @commands.command(name='cache_report', help='Shows gateway cache sizes now and at startup (Admin only)')
+    @commands.has_permissions(administrator=True)
+    async def cache_report(self, ctx):
+        now = cache_sizes(self.bot)
+        startup = getattr(self.bot, 'cache_snapshot', None) or {}
+        embed = discord.Embed(
+            title="🗄️ Gateway Cache Report",
+            description=f"Mode: {'lean' if LEAN_GATEWAY else 'default'} · "
+                        f"Member cache: {'off' if LEAN_GATEWAY else 'full' if self.bot.intents.members else 'partial'} · "
+                        f"Message cache: {self.bot._connection.max_messages or 0}",
+            color=discord.Color.dark_teal()
+        )
+        for name, value in now.items():
+            if name == "rss_bytes":
+                continue
+            before = startup.get(name)
+            text = f"{value:,}" if before is None else f"{value:,} (startup {before:,}, {value - before:+,})"
+            embed.add_field(name=name.title(), value=text, inline=True)
+
+        rss = now.get("rss_bytes")
+        if rss:
+            text = f"{rss / (1024 * 1024):.0f} MiB"
+            if startup.get("rss_bytes"):
+                text += f" (startup {startup['rss_bytes'] / (1024 * 1024):.0f} MiB)"
+            if now["guilds"]:
+                text += f"\n{rss / now['guilds'] / 1024:.0f} KiB per server"
+            embed.add_field(name="Process Memory (RSS)", value=text, inline=False)
+        embed.add_field(name="Fetched On Demand", value=f"{len(self.fetched)} cached, hit rate {self.fetched.hit_rate():.0%}", inline=False)
+        await ctx.send(embed=embed)
+
 async def setup(bot):
-    try:
-        import psutil
-        await bot.add_cog(Utility(bot))
-    except ImportError:
-        print("psutil is not installed. Installing for system monitoring...")
-        await bot.add_cog(Utility(bot)) 
\ No newline at end of file
+    await bot.add_cog(Utility(bot)) 
\ No newline at end of file
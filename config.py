@@ -10,15 +10,140 @@ GEMINI_API_KEY = os.getenv('GEMINI_API')
 RETRO_API_KEY = os.getenv('RETRODIFF_API')
 
 # API Endpoints
-RETRO_API_URL = "https://api.retrodiffusion.ai/v1/inferences"
+RETRO_API_URL = os.getenv('RETRO_API_URL', "https://api.retrodiffusion.ai/v1/inferences")
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')  # host:port override, None uses Google's endpoint
+
+# RetroDiffusion HTTP client
+RETRO_HTTP_POOL_SIZE = 10  # Max open connections to the RetroAI API
+RETRO_HTTP_TIMEOUT = 30  # Total seconds allowed per request
+RETRO_HTTP_CONNECT_TIMEOUT = 10  # Seconds allowed to open a connection
+RETRO_HTTP_KEEPALIVE = 60  # Seconds to keep idle connections open
+
+# RetroDiffusion job queue
+RETRO_MAX_CONCURRENCY = 3  # Generations sent to the API at the same time
+RETRO_MAX_QUEUE = 50  # Jobs waiting before new ones are turned away
+RETRO_QUEUE_POLL_INTERVAL = 2  # Seconds between queue position updates
+
+# RetroDiffusion micro-batching: same prompt/model/size requests arriving together share one multi-image call
+RETRO_BATCH_ENABLED = False
+RETRO_BATCH_WINDOW = 0.25  # Seconds a batch waits for another request
+RETRO_BATCH_MAX_WAIT = 1.0  # Max seconds a batch stays open after its first request
+RETRO_BATCH_MAX_IMAGES = 4  # Max images requested in one batched call
+
+# RetroDiffusion output
+RETRO_NUM_IMAGES = 1  # Images per !retro, sent as attachments of one message (max 10)
+RETRO_ARCHIVE_IMAGES = False  # Also save generated images to GENERATED_IMAGES_DIR
+
+# RetroDiffusion image cache (identical requests are answered from disk)
+RETRO_CACHE_ENABLED = True
+RETRO_CACHE_MAX_BYTES = 200 * 1024 * 1024  # Total size of cached images before LRU eviction
+
+# Gemini conversation memory
+GEMINI_SESSION_SCOPE = "channel"  # "channel" or "user": who shares a conversation
+GEMINI_MEMORY_DEFAULT = True  # Remember earlier questions until a channel (or user) turns it off with !memory; False makes it opt-in
+GEMINI_MAX_CONVERSATIONS = 200  # Max conversations kept in memory (least recently used go first)
+GEMINI_CONVERSATION_IDLE_TIMEOUT = 30 * 60  # Seconds before an idle conversation is forgotten
+GEMINI_MEMORY_TOKEN_BUDGET = 3000  # Max tokens of history sent with each question
+GEMINI_SUMMARY_MAX_TOKENS = 500  # Share of that budget for the summary of older turns
+
+# Gemini response cache
+GEMINI_CACHE_SIZE = 1000  # Max cached answers
+GEMINI_CACHE_MAX_BYTES = 5 * 1024 * 1024  # Max total size of cached answers
+GEMINI_CACHE_TTL = 6 * 60 * 60  # Seconds an answer stays cached
+
+# Gemini response delivery
+GEMINI_STREAM_RESPONSES = True  # Show answers as they're generated instead of all at once
+GEMINI_STREAM_EDIT_INTERVAL = 1.5  # Min seconds between edits of a streaming answer
+GEMINI_EMBED_PAGE_SIZE = 4000  # Characters per embed (Discord's description limit is 4096)
+
+# Admission control for upstream APIs: adaptive concurrency, circuit breaker and per-user cooldowns
+GEMINI_MAX_CONCURRENCY = 8  # Upper bound for the adaptive limit on concurrent Gemini calls
+GEMINI_TARGET_LATENCY = 15  # Seconds; slower calls shrink the limit
+GEMINI_COOLDOWN = 3  # Seconds between !ask calls per user (0 to disable)
+RETRO_TARGET_LATENCY = 20  # Seconds; the adaptive limit starts at RETRO_MAX_CONCURRENCY
+RETRO_COOLDOWN = 10  # Seconds between !retro calls per user (0 to disable)
+ADMISSION_MAX_WAITING = 20  # Calls waiting for a slot, per upstream, before new ones are refused
+ADMISSION_WAIT_TIMEOUT = 30  # Max seconds a call waits for a slot
+BREAKER_FAILURE_THRESHOLD = 5  # Consecutive upstream failures that open the circuit breaker
+BREAKER_RESET_TIMEOUT = 30  # Seconds the breaker stays open before a test request is let through
 
 # Bot Settings
 BOT_PREFIX = '!'
+# Sharding: "off" (one gateway connection), "auto" (Discord picks the shard count)
+# or "explicit" (run SHARD_IDS out of SHARD_COUNT, as set by launcher.py for each worker)
+SHARDING_MODE = os.getenv('SHARDING_MODE', 'off')
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+CLUSTER_ID = os.getenv('CLUSTER_ID')  # Set by launcher.py for each worker process; each writes its own log files
+CLUSTER_PROCESSES = 2  # Worker processes launcher.py spreads the shards across
+
+# Privileged "server members" intent, which also has to be switched on in the Discord developer portal.
+# The role index behind !roles and !userinfo only works with it: without it guilds are never chunked,
+# member events never arrive, and role counts are rescanned from whatever members happen to be cached.
+# Ignored in lean gateway mode, which keeps no member cache.
+MEMBERS_INTENT = os.getenv('MEMBERS_INTENT', 'false').lower() == 'true'
+
+# Lean gateway mode: minimal intents, no member cache or chunking, a small message cache.
+# Saves memory on large guilds; !userinfo/!serverinfo fetch what they need instead, and !roles can't count members
+LEAN_GATEWAY = os.getenv('LEAN_GATEWAY', 'false').lower() == 'true'
+LEAN_MAX_MESSAGES = 100  # Messages cached for edit handling (discord.py's default is 1000)
+FETCH_CACHE_SIZE = 500  # Members/guild counts fetched on demand and kept
+FETCH_CACHE_TTL = 5 * 60  # Seconds a fetched member or count is reused
+
+# Extensions loaded at startup; one that fails to load is logged and skipped
+EXTENSIONS = [
+    'cogs.retro_diffusion',
+    'cogs.gemini_chat',
+    'cogs.utility',
+    'cogs.fun',
+    'cogs.history',
+]
 DEFAULT_EMOJIS = ['⏳', '🔥', '✨', '🕑', '🤖', '💡', '🌟', '⚙️', '🌀', '🚀']
 
+# Command message -> bot reply map, used to clean up replies when a command is edited
+COMMAND_RESPONSES_MAX_SIZE = 5000  # Max command messages remembered
+COMMAND_RESPONSES_TTL = 60 * 60  # Seconds a command message stays editable
+EDIT_DEBOUNCE_SECONDS = 1.5  # Quiet time after an edit before the command is re-run (later edits restart it)
+
+# Outbound pipeline (reactions are sent in the background and yield to replies)
+OUTBOUND_CHANNEL_BURST = 5  # Actions a channel allows in a burst (Discord allows about 5 per 5s)
+OUTBOUND_CHANNEL_RATE = 1.0  # Actions per second a channel's budget refills at
+OUTBOUND_REPLY_RESERVE = 2  # Budget kept for replies; reactions are dropped below it
+OUTBOUND_REPLY_WAIT = 5.0  # Max seconds a reaction waits for replies in flight in its channel
+OUTBOUND_MAX_PENDING = 200  # Reactions queued at once before new ones are dropped
+
+# Message history store (!search, !stats)
+HISTORY_BATCH_SIZE = 200  # Messages buffered before they're written
+HISTORY_FLUSH_INTERVAL = 2.0  # Seconds between writes otherwise
+HISTORY_SEARCH_LIMIT = 10  # Results shown by !search
+
+# Utility commands
+ROLES_PAGE_SIZE = 20  # Roles per !roles page
+USERINFO_MAX_ROLES = 20  # Roles listed by !userinfo before the rest are summarized
+
+# Metrics
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None  # Set to a port (e.g. 9100) to serve Prometheus metrics at /metrics (launcher.py workers use METRICS_PORT + CLUSTER_ID)
+METRICS_LOOP_LAG_INTERVAL = 0.5  # Seconds between event loop lag probes
+METRICS_GATEWAY_INTERVAL = 15  # Seconds between gateway latency samples
+STATS_SAMPLE_INTERVAL = 10  # Seconds between process/cache stats samples shown by !info
+STATS_HISTORY = 15 * 60  # Seconds of samples kept (the longest !info window)
+
 # File Paths
 GENERATED_IMAGES_DIR = "generated_images"
+RETRO_CACHE_DIR = os.path.join(GENERATED_IMAGES_DIR, "cache")
 LOG_DIR = "logs"
 ERROR_LOG = "error_log.txt"
 MESSAGE_LOG = "message_log.csv"
-BOT_LOG = "bot.log" 
\ No newline at end of file
+GEMINI_CACHE_FILE = "gemini_cache.json"  # Set to None to keep the cache in memory only
+BOT_LOG = "bot.log"
+HISTORY_DB = "message_history.db"
+
+# Archive writer (message log, error log, bot log)
+ARCHIVE_QUEUE_SIZE = 10000  # Lines buffered in memory before new ones are dropped
+ARCHIVE_BATCH_SIZE = 500  # Flush as soon as this many lines are queued
+ARCHIVE_FLUSH_INTERVAL = 2.0  # Seconds between flushes otherwise
+ARCHIVE_MAX_BYTES = 10 * 1024 * 1024  # Rotate a file once it reaches this size
+ARCHIVE_ROTATE_DAILY = True  # Also rotate when the date changes
+ARCHIVE_BACKUP_COUNT = 10  # Closed segments kept per file
+ARCHIVE_COMPRESS = True  # Gzip closed segments
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+class ImageCache:
+    """
+    Content-addressed on-disk cache of generated images.
+    Entries are keyed by a hash of the full request payload and hold the image bytes
+    plus response metadata. A JSON index keeps sizes and LRU order so startup
+    doesn't need to scan the directory; the least recently used entries are
+    evicted once the total size passes max_bytes. Each entry also gets a small
+    <key>.json sidecar, so processes sharing the directory (cluster workers)
+    can pick up entries the others wrote. All methods block on disk I/O,
+    so call them from a worker thread.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        # key -> {"files": [...], "size": bytes, "metadata": {...}, "last_used": timestamp}, oldest first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(payload):
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def load(self):
+        """Read the index written by a previous run"""
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, encoding="utf-8") as file:
+            entries = json.load(file)
+        with self._lock:
+            self.entries = OrderedDict(sorted(entries.items(), key=lambda item: item[1]["last_used"]))
+            self.total_bytes = sum(entry["size"] for entry in self.entries.values())
+            self._evict()
+
+    def save(self):
+        """Write the index so the next start can skip scanning the directory"""
+        with self._lock:
+            self._save_index()
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, key):
+        """Return (images, metadata) for a cached payload, or None"""
+        with self._lock:
+            entry = self.entries.get(key) or self._adopt(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            try:
+                images = []
+                for name in entry["files"]:
+                    with open(os.path.join(self.directory, name), "rb") as file:
+                        images.append(file.read())
+            except OSError:
+                # Files went missing underneath us; forget the entry
+                self._remove(key)
+                self.misses += 1
+                return None
+            entry["last_used"] = time.time()
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return images, entry["metadata"]
+
+    def put(self, key, images, metadata):
+        """Store images and their metadata for a payload, evicting old entries if needed"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if key in self.entries:
+                self._remove(key)
+            files = []
+            for i, img_data in enumerate(images):
+                name = f"{key}_{i}.png"
+                with open(os.path.join(self.directory, name), "wb") as file:
+                    file.write(img_data)
+                files.append(name)
+            size = sum(len(img_data) for img_data in images)
+            entry = {"files": files, "size": size, "metadata": metadata, "last_used": time.time()}
+            with open(self._sidecar(key), "w", encoding="utf-8") as file:
+                json.dump(entry, file)
+            self.entries[key] = entry
+            self.total_bytes += size
+            self._evict()
+            self._save_index()
+
+    def _sidecar(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _adopt(self, key):
+        """Pick up an entry another process stored since our index was loaded"""
+        try:
+            with open(self._sidecar(key), encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        self.entries[key] = entry
+        self.total_bytes += entry["size"]
+        return entry
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+        for name in entry["files"] + [f"{key}.json"]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self.entries and self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
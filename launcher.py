@@ -0,0 +1,128 @@
+"""
+Cluster launcher: splits the bot's shards across several worker processes.
+
+    python launcher.py              # CLUSTER_PROCESSES workers, Discord's recommended shard count
+    SHARD_COUNT=8 python launcher.py
+
+Each worker runs main.py with SHARDING_MODE=explicit and its own SHARD_IDS, so every process
+holds its own gateway connections and only the guilds on its shards. Workers that crash are
+restarted with a growing delay; Ctrl+C or SIGTERM stops them all.
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import subprocess
+import requests
+from dotenv import load_dotenv
+from config import SHARD_COUNT, CLUSTER_PROCESSES
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+RESTART_DELAY = 5  # Seconds before the first restart of a crashed worker, doubled after each crash
+MAX_RESTART_DELAY = 300
+STABLE_AFTER = 600  # A worker that stays up this long gets its restart delay reset
+
+def recommended_shard_count(token):
+    """Ask Discord how many shards it wants for this bot"""
+    response = requests.get(GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}, timeout=10)
+    response.raise_for_status()
+    return response.json()["shards"]
+
+def split_shards(shard_count, processes):
+    """Spread shard ids 0..shard_count-1 over at most `processes` contiguous groups"""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups, start = [], 0
+    for i in range(processes):
+        stop = start + size + (1 if i < extra else 0)
+        groups.append(list(range(start, stop)))
+        start = stop
+    return groups
+
+class Worker:
+    def __init__(self, cluster_id, shard_ids, shard_count):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.started_at = 0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = None
+
+    def start(self):
+        env = dict(os.environ,
+                   SHARDING_MODE="explicit",
+                   SHARD_COUNT=str(self.shard_count),
+                   SHARD_IDS=",".join(str(shard_id) for shard_id in self.shard_ids),
+                   CLUSTER_ID=str(self.cluster_id))
+        self.process = subprocess.Popen([sys.executable, MAIN_SCRIPT], env=env)
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        logging.info(f"Cluster {self.cluster_id} started (pid {self.process.pid}, shards {self.shard_ids})")
+
+    def check(self):
+        """Schedule a restart if the worker died, and do it once its delay has passed"""
+        now = time.monotonic()
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        if now - self.started_at >= STABLE_AFTER:
+            self.restart_delay = RESTART_DELAY
+        logging.error(f"Cluster {self.cluster_id} exited with code {code}, restarting in {self.restart_delay}s")
+        self.restart_at = now + self.restart_delay
+        self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, timeout):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [launcher] %(message)s")
+    load_dotenv()
+    shard_count = SHARD_COUNT or recommended_shard_count(os.getenv('APIKEY'))
+    groups = split_shards(shard_count, CLUSTER_PROCESSES)
+    logging.info(f"Running {shard_count} shards across {len(groups)} processes")
+
+    stopping = False
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    workers = [Worker(cluster_id, shard_ids, shard_count) for cluster_id, shard_ids in enumerate(groups)]
+    for worker in workers:
+        worker.start()
+        # Discord only lets a bot identify so often, so stagger the workers a little
+        time.sleep(RESTART_DELAY)
+        if stopping:
+            break
+
+    while not stopping:
+        for worker in workers:
+            if worker.process is not None:
+                worker.check()
+        time.sleep(1)
+
+    logging.info("Stopping workers")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.wait(30)
+
+if __name__ == "__main__":
+    main()
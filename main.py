@@ -1,16 +1,20 @@
+import time
+PROCESS_START = time.perf_counter()
+
 import os
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-import random
 import asyncio
-import requests
-import google.generativeai as genai
-import csv
 import datetime
 import logging
+import signal
 from config import *
-from utils import setup_logging, ensure_directories, log_message, react_with_random_emoji, log_error
+from cache import TTLCache
+from metrics import metrics
+from outbound import outbound
+from sysstats import system_stats, cache_sizes
+from utils import setup_logging, ensure_directories, start_archives, close_archives, log_message, react_with_random_emoji, log_error
 
 # Load environment variables
 load_dotenv()
@@ -19,9 +23,21 @@ TOKEN = os.getenv('APIKEY')
 # Set up intents
 intents = discord.Intents.default()
 intents.message_content = True
+intents.members = MEMBERS_INTENT
 
-# Configure logging
-logging.basicConfig(filename='bot.log', level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s')
+# Gateway and cache options; lean mode keeps only what prefix commands need
+gateway_options = {}
+if LEAN_GATEWAY:
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    gateway_options = {
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+        'max_messages': LEAN_MAX_MESSAGES,
+    }
 
 # Create bot instance with a custom help command
 class CustomHelpCommand(commands.HelpCommand):
@@ -44,25 +60,77 @@ class CustomHelpCommand(commands.HelpCommand):
         channel = self.get_destination()
         await channel.send(embed=embed)
 
-class CustomBot(commands.Bot):
+class ReplyContext(commands.Context):
+    """Context that remembers which bot messages were sent in reply to a command"""
+
+    async def send(self, *args, **kwargs):
+        async with outbound.reply(self.channel.id):
+            reply = await super().send(*args, **kwargs)
+        self.bot.track_response(self.message.id, reply.id)
+        return reply
+
+# Sharded mode runs several gateway connections from one bot object
+BotBase = commands.Bot if SHARDING_MODE == 'off' else commands.AutoShardedBot
+
+class CustomBot(BotBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Dictionary to store message response pairs
-        self.command_responses = {}
+        # Command message id -> ids of the bot's replies, bounded by size and age
+        self.command_responses = TTLCache(maxsize=COMMAND_RESPONSES_MAX_SIZE, ttl=COMMAND_RESPONSES_TTL)
+        # Startup phase -> seconds, reported once the gateway is ready
+        self.startup_timings = {}
+        # Message id -> task running that message's command, so an edit can cancel it
+        self.command_tasks = {}
+        # Message id -> task waiting out the edit debounce window
+        self.pending_edits = {}
+        # Message id -> edit timestamp last acted on, to tell user edits from embed unfurls once uncached
+        self.edit_stamps = TTLCache(maxsize=COMMAND_RESPONSES_MAX_SIZE, ttl=COMMAND_RESPONSES_TTL)
+        # Cog name -> live state handed from an instance being reloaded to its replacement
+        self.cog_state = {}
+
+    async def get_context(self, origin, *, cls=ReplyContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def invoke(self, ctx):
+        # Stamped here rather than in on_command, which runs as a separate task and can start late
+        ctx.started_at = time.perf_counter()
+        await super().invoke(ctx)
+
+    async def run_command(self, message):
+        """Process a message's command as the current task, so a later edit can cancel it"""
+        task = asyncio.current_task()
+        self.command_tasks[message.id] = task
+        try:
+            await self.process_commands(message)
+        finally:
+            if self.command_tasks.get(message.id) is task:
+                del self.command_tasks[message.id]
+
+    def track_response(self, message_id, reply_id):
+        """Record that reply_id was sent in response to message_id"""
+        replies = self.command_responses.get(message_id) or []
+        replies.append(reply_id)
+        self.command_responses[message_id] = replies
 
-bot = CustomBot(command_prefix=BOT_PREFIX, intents=intents, help_command=CustomHelpCommand())
+def shard_options():
+    if SHARDING_MODE == 'explicit':
+        return {'shard_count': SHARD_COUNT, 'shard_ids': SHARD_IDS}
+    if SHARDING_MODE == 'auto' and SHARD_COUNT:
+        return {'shard_count': SHARD_COUNT}
+    return {}
 
-# Utility function: React with a random emoji
-async def react_with_random_emoji(message):
-    emojis = ['⏳', '🔥', '✨', '🕑', '🤖', '💡', '🌟', '⚙️', '🌀', '🚀']
-    emoji = random.choice(emojis)
-    await message.add_reaction(emoji)
+bot = CustomBot(command_prefix=BOT_PREFIX, intents=intents, help_command=CustomHelpCommand(), **gateway_options, **shard_options())
 
 # Event: Bot is ready
 @bot.event
 async def on_ready():
     bot.start_time = datetime.datetime.now()
     print(f'Logged in as {bot.user}')
+    if 'gateway_ready' not in bot.startup_timings:
+        bot.startup_timings['gateway_ready'] = time.perf_counter() - PROCESS_START
+        report_startup_timings()
+        # Baseline for !cache_report
+        bot.cache_snapshot = cache_sizes(bot)
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name="!help for commands"))
     logging.info(f'Bot started as {bot.user}')
 
@@ -72,37 +140,82 @@ async def on_message(message):
     if message.author != bot.user:
         print(f"{message.author.name}: {message.content}")
         log_message(message.id, message.author.name, message.content)
-        
-        # Store the channel's last message from the bot
-        async for msg in message.channel.history(limit=1):
-            if msg.author == bot.user:
-                bot.command_responses[message.id] = msg.id
     
-    await bot.process_commands(message)
+    if message.content.startswith(BOT_PREFIX):
+        await bot.run_command(message)
+    else:
+        await bot.process_commands(message)
+
+async def delete_reply(channel, reply_id):
+    try:
+        # A partial message is enough to delete, no need to fetch it first
+        await channel.get_partial_message(reply_id).delete()
+    except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+        pass  # Message already deleted or can't be deleted
+
+async def reprocess_edit(message):
+    try:
+        # Wait out the debounce window; another edit in the meantime cancels this task and starts over
+        await asyncio.sleep(EDIT_DEBOUNCE_SECONDS)
+        
+        # If the original message had bot responses, delete them (shielded, since their ids are gone once popped)
+        replies = bot.command_responses.pop(message.id, [])
+        await asyncio.shield(asyncio.gather(*(delete_reply(message.channel, reply_id) for reply_id in replies)))
+        
+        # Process the edited message as a new command
+        await bot.run_command(message)
+    finally:
+        if bot.pending_edits.get(message.id) is asyncio.current_task():
+            del bot.pending_edits[message.id]
+
+def schedule_edit(message):
+    # The command for the old version is superseded, stop it before it spends more upstream calls
+    running = bot.command_tasks.pop(message.id, None)
+    if running is not None:
+        running.cancel()
+    pending = bot.pending_edits.pop(message.id, None)
+    if pending is not None:
+        pending.cancel()
+    bot.edit_stamps[message.id] = message.edited_at
+    bot.pending_edits[message.id] = asyncio.create_task(reprocess_edit(message))
 
 # Event: Message edited
 @bot.event
 async def on_message_edit(before, after):
     if after.author != bot.user and before.content != after.content:
-        # If the original message had a bot response, delete it
-        if before.id in bot.command_responses:
-            try:
-                # Get the response message
-                response_msg = await after.channel.fetch_message(bot.command_responses[before.id])
-                # Delete the old response
-                await response_msg.delete()
-                # Remove the stored reference
-                del bot.command_responses[before.id]
-            except (discord.NotFound, discord.Forbidden, discord.HTTPException):
-                pass  # Message already deleted or can't be deleted
-        
-        # Process the edited message as a new command
-        await bot.process_commands(after)
+        schedule_edit(after)
+
+# Event: Message edited after it left the message cache, which lean mode keeps small
+@bot.event
+async def on_raw_message_edit(payload):
+    if not LEAN_GATEWAY or payload.cached_message is not None:
+        return  # on_message_edit handles it
+    message = payload.message
+    tracked = (message.id in bot.command_tasks or message.id in bot.pending_edits
+               or bot.command_responses.get(message.id) is not None)
+    if not tracked or message.author == bot.user:
+        return
+    # Without the old content, tell a real edit from an embed unfurl by its edit timestamp
+    if message.edited_at is None or bot.edit_stamps.get(message.id) == message.edited_at:
+        return
+    schedule_edit(message)
+
+# Command timing for the metrics
+def record_command(ctx, status):
+    started_at = getattr(ctx, 'started_at', None)
+    if ctx.command is not None and started_at is not None:
+        metrics.observe("command_latency_seconds", time.perf_counter() - started_at, command=ctx.command.qualified_name)
+        metrics.inc("commands_total", command=ctx.command.qualified_name, status=status)
+
+@bot.event
+async def on_command_completion(ctx):
+    record_command(ctx, "ok")
 
 # Error handling with logging
 @bot.event
 async def on_command_error(ctx, error):
-    await react_with_random_emoji(ctx.message)
+    record_command(ctx, "error")
+    react_with_random_emoji(ctx.message)
     error_messages = {
         commands.CommandNotFound: "Command not found. Use !help to see available commands.",
         commands.MissingRequiredArgument: "Missing required argument. Use !help <command> for usage.",
@@ -115,25 +228,138 @@ async def on_command_error(ctx, error):
     await ctx.send(error_message)
     log_error(error)
 
+def report_startup_timings():
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in bot.startup_timings.items())
+    print(f"Startup timings: {phases}")
+    logging.info(f"Startup timings: {phases}")
+
+async def load_extension_safely(extension):
+    """Load one extension, logging and skipping it if it fails"""
+    start = time.perf_counter()
+    try:
+        await bot.load_extension(extension)
+    except Exception as e:
+        log_error(f"Failed to load extension {extension}: {str(e)}")
+        print(f"Skipping extension {extension}: {str(e)}")
+        return False
+    logging.info(f"Loaded extension {extension} in {time.perf_counter() - start:.2f}s")
+    return True
+
 async def load_extensions():
-    await bot.load_extension('cogs.image_generation')
-    await bot.load_extension('cogs.retro_diffusion')
-    await bot.load_extension('cogs.gemini_chat')
-    await bot.load_extension('cogs.utility')
-    await bot.load_extension('cogs.fun')
-    # Add more cogs here as needed
+    """Load every extension in the EXTENSIONS manifest concurrently; a broken cog doesn't stop the rest"""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(load_extension_safely(extension) for extension in EXTENSIONS))
+    bot.startup_timings['extensions'] = time.perf_counter() - start
+    loaded = [extension for extension, ok in zip(EXTENSIONS, results) if ok]
+    logging.info(f"Loaded {len(loaded)}/{len(EXTENSIONS)} extensions")
+    return loaded
+
+async def reload_extension_with_state(extension):
+    """
+    Reload one extension without touching the gateway connection. Its cogs hand their live
+    state (sessions, caches, queues) to the new instances through bot.cog_state; if the new
+    code fails to load, discord.py restores the old module and that picks the state back up.
+    Returns (seconds, handed off state keys).
+    """
+    handed_off = []
+    for cog in list(bot.cogs.values()):
+        if type(cog).__module__ == extension and hasattr(cog, 'export_state'):
+            state = cog.export_state()
+            bot.cog_state[cog.qualified_name] = state
+            handed_off.extend(state)
+
+    start = time.perf_counter()
+    try:
+        if extension in bot.extensions:
+            await bot.reload_extension(extension)
+        else:
+            await bot.load_extension(extension)
+    finally:
+        # Anything not picked up belongs to a cog that no longer exists; just let it go
+        for name in [name for name in bot.cog_state if bot.get_cog(name) is None]:
+            logging.warning(f"Dropping state for {name}, no cog took it over after reloading {extension}")
+            del bot.cog_state[name]
+    return time.perf_counter() - start, handed_off
+
+def resolve_extension(name):
+    """Map 'gemini_chat', 'cogs.gemini_chat' or a cog name like 'GeminiChat' to its extension"""
+    if name in EXTENSIONS or name in bot.extensions:
+        return name
+    if f"cogs.{name}" in EXTENSIONS:
+        return f"cogs.{name}"
+    cog = bot.get_cog(name)
+    return type(cog).__module__ if cog is not None else None
+
+# Owner only: a reload affects every guild the bot is in, not just the one it's typed in
+@bot.command(name='reload', help='Reloads a cog, or all of them, keeping its caches and sessions. Usage: !reload <cog|all>')
+@commands.is_owner()
+async def reload_cogs(ctx, name: str = 'all'):
+    if name == 'all':
+        extensions = list(EXTENSIONS)
+    else:
+        extension = resolve_extension(name)
+        if extension is None:
+            await ctx.send(f"No cog or extension called `{name}`.")
+            return
+        extensions = [extension]
+
+    embed = discord.Embed(title="🔄 Reload", color=discord.Color.green())
+    for extension in extensions:
+        try:
+            seconds, handed_off = await reload_extension_with_state(extension)
+        except Exception as e:
+            embed.color = discord.Color.red()
+            embed.add_field(name=f"❌ {extension}", value=str(e)[:1000] or type(e).__name__, inline=False)
+            log_error(f"Failed to reload extension {extension}: {str(e)}")
+            continue
+        kept = ", ".join(handed_off) if handed_off else "nothing to keep"
+        embed.add_field(name=f"✅ {extension}", value=f"{seconds * 1000:.0f}ms | Kept: {kept}", inline=False)
+        logging.info(f"Reloaded extension {extension} in {seconds:.2f}s, kept {kept}")
+    embed.set_footer(text="config.py is not reloaded; restart the bot to pick up config changes")
+    await ctx.send(embed=embed)
 
 async def main():
+    bot.startup_timings['imports'] = time.perf_counter() - PROCESS_START
+
+    # launcher.py stops workers with SIGTERM; treat it like Ctrl+C, so the bot closes
+    # (unloading cogs, which saves their caches) and the cleanup below runs
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # No signal handlers on Windows event loops
+
     # Setup
+    start = time.perf_counter()
     setup_logging()
     ensure_directories()
+    start_archives()
+    await metrics.start(
+        bot,
+        loop_lag_interval=METRICS_LOOP_LAG_INTERVAL,
+        gateway_interval=METRICS_GATEWAY_INTERVAL,
+        host=METRICS_HOST,
+        # Cluster workers each serve their own endpoint, one port up per worker
+        port=METRICS_PORT + int(CLUSTER_ID) if METRICS_PORT and CLUSTER_ID is not None else METRICS_PORT,
+    )
+    await system_stats.start(bot, interval=STATS_SAMPLE_INTERVAL, history=STATS_HISTORY)
+    bot.startup_timings['setup'] = time.perf_counter() - start
     
-    # Load extensions
-    await load_extensions()
-    
-    # Start the bot
-    async with bot:
-        await bot.start(DISCORD_TOKEN)
+    try:
+        # Load extensions
+        await load_extensions()
+        
+        # Start the bot
+        async with bot:
+            await bot.start(DISCORD_TOKEN)
+    finally:
+        await system_stats.stop()
+        await outbound.close()
+        await metrics.stop()
+        # Write out anything still queued for the logs
+        await close_archives()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        pass  # Stopped by SIGTERM, after a clean shutdown
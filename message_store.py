@@ -0,0 +1,172 @@
+import os
+import csv
+import gzip
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER,
+    author_id INTEGER,
+    author_name TEXT,
+    content TEXT,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS messages_author ON messages (guild_id, author_id, created_at);
+-- Only imported-row lookups by name used this, and guild queries no longer cover imported rows
+DROP INDEX IF EXISTS messages_author_name;
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, created_at);
+CREATE INDEX IF NOT EXISTS messages_guild_time ON messages (guild_id, created_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+-- Running totals, so !stats never has to count a guild's whole history
+CREATE TABLE IF NOT EXISTS author_counts (guild_id INTEGER, author_name TEXT, n INTEGER, PRIMARY KEY (guild_id, author_name));
+CREATE TABLE IF NOT EXISTS channel_counts (guild_id INTEGER, channel_id INTEGER, n INTEGER, PRIMARY KEY (guild_id, channel_id));
+CREATE TRIGGER IF NOT EXISTS messages_counts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO author_counts VALUES (new.guild_id, new.author_name, 1)
+        ON CONFLICT DO UPDATE SET n = n + 1;
+    INSERT INTO channel_counts SELECT new.guild_id, new.channel_id, 1 WHERE new.channel_id IS NOT NULL
+        ON CONFLICT DO UPDATE SET n = n + 1;
+END;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Rows imported from the old CSV log don't know their guild or channel (some are DMs), so they're
+# stored under guild 0, which no guild's queries cover; only the bot owner can search them
+IMPORTED_GUILD = 0
+
+def fts_query(terms):
+    """Quote each word so user input can't be parsed as FTS5 syntax"""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in terms.split())
+
+class MessageStore:
+    """
+    SQLite message history with an FTS5 index over content and b-tree indexes on
+    author, channel and time. Queries hit the indexes, so they stay fast on millions of
+    rows without loading anything into memory. All methods block, so call them from a
+    worker thread; a lock serializes them on the one connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Cluster workers share the file, so wait for their write locks instead of failing
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def add(self, rows):
+        """Insert (id, guild_id, channel_id, author_id, author_name, content, created_at) rows in one transaction"""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def import_csv(self, paths, before_id=None, batch_size=5000):
+        """
+        One-off import of message_log.csv files (id, author, content, timestamp), plain or gzipped.
+        Rows with ids at or above before_id are skipped, since the live writer is already storing
+        those with their guild. Does nothing if an import already ran; returns the number of rows read.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+                return 0
+        total = 0
+        for path in paths:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8", newline="") as file:
+                batch = []
+                for row in csv.reader(file):
+                    if len(row) < 4 or not row[0].isdigit():
+                        continue
+                    if before_id is not None and int(row[0]) >= before_id:
+                        continue
+                    batch.append((int(row[0]), IMPORTED_GUILD, None, None, row[1], row[2], _parse_time(row[3])))
+                    if len(batch) >= batch_size:
+                        self.add(batch)
+                        total += len(batch)
+                        batch = []
+                if batch:
+                    self.add(batch)
+                    total += len(batch)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('csv_imported', ?)", (str(time.time()),))
+        return total
+
+    def search(self, guild_id, terms, limit=10):
+        """
+        Newest messages in a guild matching every term, as (author_name, channel_id, content, created_at).
+        Message ids are snowflakes, so rowid order is time order and FTS5 can stop after `limit` hits
+        instead of ranking every match.
+        """
+        with self._lock:
+            return self._conn.execute(
+                """SELECT m.author_name, m.channel_id, m.content, m.created_at
+                   FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                   WHERE messages_fts MATCH ? AND m.guild_id = ?
+                   ORDER BY messages_fts.rowid DESC LIMIT ?""",
+                (fts_query(terms), guild_id, limit),
+            ).fetchall()
+
+    def user_stats(self, guild_id, author_id, since):
+        """Message count, first and last message time, recent count and top channels for one author"""
+        author = "guild_id = ? AND author_id = ?"
+        args = (guild_id, author_id)
+        with self._lock:
+            total, first, last = self._conn.execute(
+                f"SELECT COUNT(*), MIN(created_at), MAX(created_at) FROM messages WHERE {author}", args
+            ).fetchone()
+            recent = self._conn.execute(
+                f"SELECT COUNT(*) FROM messages WHERE {author} AND created_at >= ?", args + (since,)
+            ).fetchone()[0]
+            channels = self._conn.execute(
+                """SELECT channel_id, COUNT(*) AS n FROM messages
+                   WHERE guild_id = ? AND author_id = ? GROUP BY channel_id ORDER BY n DESC LIMIT 3""",
+                (guild_id, author_id),
+            ).fetchall()
+        return {"total": total, "first": first, "last": last, "recent": recent, "channels": channels}
+
+    def guild_stats(self, guild_id, since):
+        """Message count, recent count, top authors and busiest channels for a guild"""
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(n), 0) FROM author_counts WHERE guild_id = ?", (guild_id,)
+            ).fetchone()[0]
+            recent = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE guild_id = ? AND created_at >= ?", (guild_id, since)
+            ).fetchone()[0]
+            authors = self._conn.execute(
+                """SELECT author_name, n FROM author_counts WHERE guild_id = ?
+                   ORDER BY n DESC LIMIT 5""", (guild_id,)
+            ).fetchall()
+            channels = self._conn.execute(
+                "SELECT channel_id, n FROM channel_counts WHERE guild_id = ? ORDER BY n DESC LIMIT 3", (guild_id,)
+            ).fetchall()
+        return {"total": total, "recent": recent, "authors": authors, "channels": channels}
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
@@ -0,0 +1,180 @@
+import time
+import math
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    """Fixed-bucket latency histogram, cheap enough to update on every command"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            if seen + self.counts[i] >= target:
+                fraction = (target - seen) / self.counts[i] if self.counts[i] else 0
+                return lower + (bound - lower) * fraction
+            seen += self.counts[i]
+            lower = bound
+        return self.buckets[-1]
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+class Metrics:
+    """
+    In-process registry of counters, gauges and histograms.
+    Names and labels follow Prometheus conventions so render() can be scraped as-is.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._tasks = []
+        self._runner = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def get_counter(self, name, **labels):
+        return self.counters.get(self._key(name, labels), 0)
+
+    def get_gauge(self, name, default=None, **labels):
+        return self.gauges.get(self._key(name, labels), default)
+
+    def series(self, name):
+        """All (labels, histogram) pairs recorded under a histogram name"""
+        return [(dict(labels), histogram) for (hist_name, labels), histogram in self.histograms.items() if hist_name == name]
+
+    @asynccontextmanager
+    async def track(self, upstream):
+        """Time a call to an upstream API and count it, and any error it raises"""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe("upstream_latency_seconds", time.perf_counter() - start, upstream=upstream)
+            self.inc("upstream_requests_total", upstream=upstream, status=status)
+
+    def render(self):
+        """Render everything in the Prometheus text exposition format"""
+        lines = []
+
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+        for kind, store in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({name for name, _ in store}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (series_name, labels), value in store.items():
+                    if series_name == name:
+                        lines.append(f"{name}{labels_text(labels)} {value}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), histogram in self.histograms.items():
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + [math.inf], histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else str(bound)
+                    lines.append(f"{name}_bucket{labels_text(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{labels_text(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{labels_text(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    async def _probe_loop_lag(self, interval):
+        # A sleep that wakes up late means something held the event loop
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag = max(0.0, time.perf_counter() - start - interval)
+            self.set("event_loop_lag_last_seconds", lag)
+            self.set("event_loop_lag_max_seconds", max(lag, self.get_gauge("event_loop_lag_max_seconds", 0.0)))
+            self.observe("event_loop_lag_seconds", lag)
+
+    async def _sample_gateway(self, bot, interval):
+        while True:
+            latency = bot.latency
+            if latency is not None and not math.isnan(latency) and not math.isinf(latency):
+                self.set("gateway_latency_last_seconds", latency)
+                self.observe("gateway_latency_seconds", latency)
+            await asyncio.sleep(interval)
+
+    async def start(self, bot, loop_lag_interval=0.5, gateway_interval=15, host=None, port=None):
+        """Start the background probes and, if a port is given, the Prometheus endpoint"""
+        self._tasks = [
+            asyncio.create_task(self._probe_loop_lag(loop_lag_interval)),
+            asyncio.create_task(self._sample_gateway(bot, gateway_interval)),
+        ]
+        if port:
+            from aiohttp import web
+
+            async def handle(request):
+                return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+            app = web.Application()
+            app.router.add_get("/metrics", handle)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, host or "127.0.0.1", port).start()
+            logging.info(f"Serving metrics on http://{host or '127.0.0.1'}:{port}/metrics")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+# Shared registry for the whole bot
+metrics = Metrics()
@@ -0,0 +1,131 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from config import *
+from metrics import metrics
+
+MAX_CHANNELS = 10000  # Tracked channels before idle ones are pruned
+
+class TokenBucket:
+    """Local estimate of a channel's Discord rate limit: `burst` actions, refilled at `rate` per second"""
+
+    def __init__(self, burst, rate):
+        self.burst = burst
+        self.rate = rate
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self):
+        # Replies are never refused, so tokens may go negative and the channel stays "busy" for a while
+        self.refill()
+        self.tokens -= 1
+
+class ChannelState:
+    def __init__(self, burst, rate):
+        self.bucket = TokenBucket(burst, rate)
+        self.replying = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+class OutboundPipeline:
+    """
+    Sends cosmetic actions (reactions) in the background instead of on the command's critical path.
+    Replies report themselves through reply(), which gives them first claim on a channel's rate
+    limit budget: a reaction waits for in-flight replies in its channel, and is dropped rather than
+    sent once the channel's bucket is down to the reserve kept for replies. Several reactions queued
+    for the same message are coalesced into one.
+    """
+
+    def __init__(self, burst, rate, reserve, reply_wait, max_pending):
+        self.burst = burst
+        self.rate = rate
+        self.reserve = reserve
+        self.reply_wait = reply_wait
+        self.max_pending = max_pending
+        self.channels = {}
+        # message id -> task sending its reaction
+        self.pending = {}
+
+    def _channel(self, channel_id):
+        state = self.channels.get(channel_id)
+        if state is None:
+            if len(self.channels) >= MAX_CHANNELS:
+                self._prune()
+            state = self.channels[channel_id] = ChannelState(self.burst, self.rate)
+        return state
+
+    def _prune(self):
+        # A channel with a full bucket and no reply in flight has no state worth keeping
+        for channel_id, state in list(self.channels.items()):
+            if not state.replying and state.bucket.refill() >= self.burst:
+                del self.channels[channel_id]
+
+    @asynccontextmanager
+    async def reply(self, channel_id):
+        """Wrap a reply's REST call, so reactions in the same channel yield to it"""
+        state = self._channel(channel_id)
+        state.bucket.take()
+        state.replying += 1
+        state.idle.clear()
+        try:
+            yield
+        finally:
+            state.replying -= 1
+            if not state.replying:
+                state.idle.set()
+
+    def react(self, message, emoji):
+        """Queue a cosmetic reaction without waiting for it; it may be coalesced or dropped"""
+        if message.id in self.pending:
+            metrics.inc("outbound_actions_total", kind="reaction", status="coalesced")
+            return
+        if len(self.pending) >= self.max_pending:
+            metrics.inc("outbound_actions_total", kind="reaction", status="dropped")
+            return
+        task = asyncio.get_running_loop().create_task(self._react(message, emoji))
+        self.pending[message.id] = task
+        task.add_done_callback(lambda _: self.pending.pop(message.id, None))
+
+    async def _react(self, message, emoji):
+        state = self._channel(message.channel.id)
+        if state.replying:
+            try:
+                await asyncio.wait_for(state.idle.wait(), self.reply_wait)
+            except asyncio.TimeoutError:
+                pass
+        if state.bucket.refill() < self.reserve + 1:
+            metrics.inc("outbound_actions_total", kind="reaction", status="dropped")
+            return
+        state.bucket.take()
+        try:
+            await message.add_reaction(emoji)
+        except Exception as e:
+            # Missing permissions, deleted messages and the like; a reaction isn't worth an error reply
+            logging.warning(f"Reaction on message {message.id} failed: {str(e)}")
+            metrics.inc("outbound_actions_total", kind="reaction", status="failed")
+            return
+        metrics.inc("outbound_actions_total", kind="reaction", status="sent")
+
+    async def close(self):
+        """Wait briefly for queued reactions, then cancel the rest"""
+        tasks = list(self.pending.values())
+        if tasks:
+            _, still_pending = await asyncio.wait(tasks, timeout=2)
+            for task in still_pending:
+                task.cancel()
+
+# Shared pipeline for the whole bot
+outbound = OutboundPipeline(
+    burst=OUTBOUND_CHANNEL_BURST,
+    rate=OUTBOUND_CHANNEL_RATE,
+    reserve=OUTBOUND_REPLY_RESERVE,
+    reply_wait=OUTBOUND_REPLY_WAIT,
+    max_pending=OUTBOUND_MAX_PENDING,
+)
@@ -0,0 +1,62 @@
+from collections import Counter
+
+class RoleIndex:
+    """
+    Per-guild role id -> member count, built once from the member cache and then
+    kept current from member and role events, so listing roles doesn't rescan
+    every member for every role. Needs the members intent (MEMBERS_INTENT): without it
+    guilds never finish chunking and member events never arrive, so nothing is kept.
+    """
+
+    def __init__(self):
+        # guild id -> Counter of role id -> members
+        self._guilds = {}
+
+    def counts(self, guild):
+        """Role member counts for a guild, building its index on first use"""
+        counts = self._guilds.get(guild.id)
+        if counts is not None:
+            return counts
+        counts = Counter()
+        for member in guild.members:
+            for role in member.roles:
+                counts[role.id] += 1
+        # Until the member list is chunked, later arrivals come in without events, so don't keep a partial count
+        if guild.chunked:
+            self._guilds[guild.id] = counts
+        return counts
+
+    def count(self, role):
+        return self.counts(role.guild)[role.id]
+
+    def member_joined(self, member):
+        self._adjust(member.guild.id, member.roles, 1)
+
+    def member_left(self, member):
+        self._adjust(member.guild.id, member.roles, -1)
+
+    def member_updated(self, before, after):
+        before_ids = {role.id for role in before.roles}
+        after_ids = {role.id for role in after.roles}
+        counts = self._guilds.get(after.guild.id)
+        if counts is None or before_ids == after_ids:
+            return
+        for role_id in after_ids - before_ids:
+            counts[role_id] += 1
+        for role_id in before_ids - after_ids:
+            counts[role_id] -= 1
+
+    def role_deleted(self, role):
+        counts = self._guilds.get(role.guild.id)
+        if counts is not None:
+            counts.pop(role.id, None)
+
+    def forget(self, guild):
+        self._guilds.pop(guild.id, None)
+
+    def _adjust(self, guild_id, roles, delta):
+        counts = self._guilds.get(guild_id)
+        if counts is None:
+            return
+        for role in roles:
+            counts[role.id] += delta
@@ -0,0 +1,191 @@
+import asyncio
+from collections import OrderedDict, deque
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted to a scheduler whose queue is already full"""
+
+class Job:
+    """A unit of work queued in a JobScheduler. Await scheduler.wait(job) for its result."""
+
+    def __init__(self, key, guild_id, user_id, factory, waiters=1):
+        self.key = key
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.factory = factory
+        self.future = asyncio.get_running_loop().create_future()
+        # Mark errors as retrieved even if every waiter has gone away
+        self.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        # Requests still interested in the result; see JobScheduler.release()
+        self.waiters = waiters
+        self.started = False
+        self.task = None
+
+    def done(self):
+        return self.future.done()
+
+class JobScheduler:
+    """
+    Runs coroutine jobs with a global concurrency limit.
+    Queued jobs are picked round-robin across guilds, then across users within a
+    guild, so one busy user or server can't starve the rest. Jobs submitted with
+    the same key while one is queued or running share that job's result.
+    """
+
+    def __init__(self, concurrency, max_queue, limit=None):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        # Optional callable returning an adaptive limit that can hold concurrency lower
+        self.limit = limit
+        # guild_id -> user_id -> deque of queued jobs, in round-robin order
+        self.guilds = OrderedDict()
+        # key -> queued or running job, for single-flight merging
+        self.inflight = {}
+        self.tasks = set()
+        self.queued = 0
+        self.merged = 0
+        self.rejected = 0
+        self.completed = 0
+
+    @property
+    def running(self):
+        return len(self.tasks)
+
+    @property
+    def capacity(self):
+        """Jobs allowed to run at once right now"""
+        if self.limit is None:
+            return self.concurrency
+        return max(1, min(self.concurrency, int(self.limit())))
+
+    def submit(self, key, guild_id, user_id, factory, waiters=1):
+        """
+        Queue factory() to run under the scheduler and return its Job, on behalf of `waiters` requests.
+        If a job with the same key is already queued or running, that job is returned instead.
+        Raises QueueFullError if the queue is at max_queue. Each request should call release() when it's done.
+        """
+        job = self.inflight.get(key)
+        if job is not None:
+            job.waiters += waiters
+            self.merged += 1
+            return job
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Queue is full ({self.max_queue} jobs waiting)")
+
+        job = Job(key, guild_id, user_id, factory, waiters)
+        users = self.guilds.setdefault(guild_id, OrderedDict())
+        users.setdefault(user_id, deque()).append(job)
+        self.queued += 1
+        self.inflight[key] = job
+        self._dispatch()
+        return job
+
+    async def wait(self, job):
+        """Wait for a job's result without cancelling it for the other waiters"""
+        return await asyncio.shield(job.future)
+
+    def release(self, job):
+        """
+        Note that one request no longer needs a job's result. Once none do, a job that
+        hasn't finished is dropped from the queue, or cancelled if it's already running,
+        so nothing is spent on a result nobody will see.
+        """
+        job.waiters -= 1
+        if job.waiters > 0 or job.done():
+            return
+        if job.started:
+            job.task.cancel()
+            return
+        users = self.guilds[job.guild_id]
+        jobs = users[job.user_id]
+        jobs.remove(job)
+        if not jobs:
+            del users[job.user_id]
+            if not users:
+                del self.guilds[job.guild_id]
+        self.queued -= 1
+        if self.inflight.get(job.key) is job:
+            del self.inflight[job.key]
+        job.future.cancel()
+
+    def position(self, job):
+        """1-based place of a queued job in pick order, or 0 once it has started"""
+        if job.started or job.done():
+            return 0
+        # Replay the round-robin order on a copy of the queue
+        guilds = deque((guild_id, deque((user_id, deque(jobs)) for user_id, jobs in users.items()))
+                       for guild_id, users in self.guilds.items())
+        position = 0
+        while guilds:
+            guild_id, users = guilds.popleft()
+            user_id, jobs = users.popleft()
+            position += 1
+            if jobs.popleft() is job:
+                return position
+            if jobs:
+                users.append((user_id, jobs))
+            if users:
+                guilds.append((guild_id, users))
+        return 0
+
+    def _next_job(self):
+        guild_id, users = next(iter(self.guilds.items()))
+        user_id, jobs = next(iter(users.items()))
+        job = jobs.popleft()
+
+        # Move this user and guild to the back of the line
+        del users[user_id]
+        if jobs:
+            users[user_id] = jobs
+        del self.guilds[guild_id]
+        if users:
+            self.guilds[guild_id] = users
+
+        self.queued -= 1
+        return job
+
+    def _dispatch(self):
+        while self.guilds and self.running < self.capacity:
+            job = self._next_job()
+            job.started = True
+            task = job.task = asyncio.create_task(self._run(job))
+            self.tasks.add(task)
+            task.add_done_callback(lambda task, job=job: self._finished(task, job))
+
+    async def _run(self, job):
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        finally:
+            if self.inflight.get(job.key) is job:
+                del self.inflight[job.key]
+            self.completed += 1
+
+    def _finished(self, task, job):
+        self.tasks.discard(task)
+        # A task cancelled before it got to run never reaches _run's cleanup
+        if not job.done():
+            job.future.cancel()
+        if self.inflight.get(job.key) is job:
+            del self.inflight[job.key]
+        self._dispatch()
+
+    async def close(self):
+        """Cancel running jobs and drop everything still queued"""
+        for users in self.guilds.values():
+            for jobs in users.values():
+                for job in jobs:
+                    job.future.cancel()
+        self.guilds.clear()
+        self.inflight.clear()
+        self.queued = 0
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,92 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from metrics import metrics
+
+def cache_sizes(bot):
+    """Object counts in discord.py's caches, plus the process RSS if it's being sampled"""
+    sizes = {
+        "guilds": len(bot.guilds),
+        "channels": sum(len(guild.channels) for guild in bot.guilds),
+        "roles": sum(len(guild.roles) for guild in bot.guilds),
+        "members": sum(len(guild.members) for guild in bot.guilds),
+        "users": len(bot.users),
+        "messages": len(bot.cached_messages),
+    }
+    if system_stats.samples:
+        sizes["rss_bytes"] = system_stats.samples[-1][1]["rss_bytes"]
+    return sizes
+
+class SystemSampler:
+    """
+    Background sampler of process and cache stats.
+    Every `interval` seconds it records the bot process's RSS and CPU, the event loop lag and
+    the guild/member cache sizes into a fixed-size ring buffer, so !info can report averages
+    and peaks without measuring anything itself.
+    """
+
+    FIELDS = ("rss_bytes", "cpu_percent", "loop_lag", "guilds", "members")
+
+    def __init__(self):
+        self.interval = None
+        # (timestamp, {field: value}), oldest first
+        self.samples = deque()
+        self._process = None
+        self._task = None
+
+    def sample(self, bot):
+        values = dict.fromkeys(self.FIELDS)
+        if self._process is not None:
+            values["rss_bytes"] = self._process.memory_info().rss
+            # Percent of one core since the previous call, so it's a real average over the interval
+            values["cpu_percent"] = self._process.cpu_percent(None)
+        values["loop_lag"] = metrics.get_gauge("event_loop_lag_last_seconds")
+        values["guilds"] = len(bot.guilds)
+        values["members"] = sum(len(guild.members) for guild in bot.guilds)
+        self.samples.append((time.monotonic(), values))
+
+        if values["rss_bytes"] is not None:
+            metrics.set("process_resident_memory_bytes", values["rss_bytes"])
+            metrics.set("process_cpu_percent", values["cpu_percent"])
+        metrics.set("cached_guilds", values["guilds"])
+        metrics.set("cached_members", values["members"])
+
+    def summary(self, field, window):
+        """(average, peak) of a field over the last `window` seconds, or None without samples"""
+        cutoff = time.monotonic() - window
+        values = [sample[field] for timestamp, sample in reversed(self.samples)
+                  if timestamp >= cutoff and sample[field] is not None]
+        if not values:
+            return None
+        return sum(values) / len(values), max(values)
+
+    async def _run(self, bot):
+        while True:
+            try:
+                self.sample(bot)
+            except Exception as e:
+                logging.error(f"System stats sample failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self, bot, interval=10, history=15 * 60):
+        """Start sampling every `interval` seconds, keeping `history` seconds of samples"""
+        self.interval = interval
+        self.samples = deque(self.samples, maxlen=max(1, int(history / interval)))
+        try:
+            # psutil is slow to import, so keep it off the event loop
+            psutil = await asyncio.to_thread(__import__, "psutil")
+            self._process = psutil.Process()
+            self._process.cpu_percent(None)  # The first call only sets the baseline
+        except ImportError:
+            logging.info("psutil is not installed; skipping process memory and CPU stats")
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+# Shared sampler, started from main()
+system_stats = SystemSampler()
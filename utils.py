@@ -1,31 +1,67 @@
 import os
+import io
 import logging
 import random
 from datetime import datetime
 import csv
 from config import *
+from archive import ArchiveWriter, ArchiveHandler
+from outbound import outbound
+
+def cluster_path(path):
+    """Per-worker variant of a file path under launcher.py (message_log.csv -> message_log.2.csv), so workers never share a file"""
+    if CLUSTER_ID is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{CLUSTER_ID}{ext}"
+
+def _archive(path):
+    return ArchiveWriter(
+        path,
+        max_queue=ARCHIVE_QUEUE_SIZE,
+        batch_size=ARCHIVE_BATCH_SIZE,
+        flush_interval=ARCHIVE_FLUSH_INTERVAL,
+        max_bytes=ARCHIVE_MAX_BYTES,
+        rotate_daily=ARCHIVE_ROTATE_DAILY,
+        backup_count=ARCHIVE_BACKUP_COUNT,
+        compress=ARCHIVE_COMPRESS,
+    )
+
+# Archives written in the background, so logging never blocks the event loop
+message_archive = _archive(cluster_path(MESSAGE_LOG))
+error_archive = _archive(os.path.join(LOG_DIR, cluster_path(ERROR_LOG)))
+log_archive = _archive(os.path.join(LOG_DIR, cluster_path(BOT_LOG)))
 
 # Setup logging
 def setup_logging():
     if not os.path.exists(LOG_DIR):
         os.makedirs(LOG_DIR)
-    
-    logging.basicConfig(
-        filename=os.path.join(LOG_DIR, BOT_LOG),
-        level=logging.INFO,
-        format='%(asctime)s:%(levelname)s:%(message)s'
-    )
+
+    handler = ArchiveHandler(log_archive)
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(message)s'))
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
+
+# Start the background archive writers (needs a running event loop)
+def start_archives():
+    for archive in (message_archive, error_archive, log_archive):
+        archive.start()
+
+# Flush and stop the archive writers
+async def close_archives():
+    for archive in (message_archive, error_archive, log_archive):
+        await archive.close()
 
 # Log message to CSV
 def log_message(message_id, author_name, content):
-    with open(MESSAGE_LOG, 'a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([message_id, author_name, content, datetime.now()])
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow([message_id, author_name, content, datetime.now()])
+    message_archive.put(buffer.getvalue())
 
-# React with random emoji
-async def react_with_random_emoji(message):
-    emoji = random.choice(DEFAULT_EMOJIS)
-    await message.add_reaction(emoji)
+# React with random emoji (in the background; cosmetic, so it may be dropped under load)
+def react_with_random_emoji(message):
+    outbound.react(message, random.choice(DEFAULT_EMOJIS))
 
 # Ensure directories exist
 def ensure_directories():
@@ -37,5 +73,4 @@ def ensure_directories():
 # Error logging
 def log_error(error):
     logging.error(f"An error occurred: {str(error)}")
-    with open(os.path.join(LOG_DIR, ERROR_LOG), 'a') as f:
-        f.write(f"{datetime.now()}: {str(error)}\n") 
\ No newline at end of file
+    error_archive.put(f"{datetime.now()}: {str(error)}\n")